@@ -87,6 +87,15 @@ DATABASES = {
     }
 }
 
+# 默认为进程内缓存，各进程之间互不可见，订单统计等缓存的失效只对当前进程有效，其他进程等待缓存过期；
+# 需要跨进程失效时配置共享缓存，如 django.core.cache.backends.redis.RedisCache（需要安装 redis）
+CACHES = {
+    "default": {
+        "BACKEND": _YAML_CONFIG.get("CacheBackend", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": _YAML_CONFIG.get("CacheLocation", ""),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -127,6 +136,38 @@ S3_SSL = _YAML_CONFIG["S3UseSSL"]
 S3_SECRET_ID = _YAML_CONFIG["S3SecretId"]
 S3_SECRET_KEY = _YAML_CONFIG["S3SecretKey"]
 S3_BUCKET_NAME = _YAML_CONFIG["S3Bucket"]
+S3_POOL_SIZE = _YAML_CONFIG.get("S3PoolSize", 32)
+S3_POOL_TIMEOUT = _YAML_CONFIG.get("S3PoolTimeout", 5)
+S3_CONNECT_TIMEOUT = _YAML_CONFIG.get("S3ConnectTimeout", 3)
+S3_READ_TIMEOUT = _YAML_CONFIG.get("S3ReadTimeout", 30)
+S3_RETRIES = _YAML_CONFIG.get("S3Retries", 3)
+S3_RETRY_BACKOFF = _YAML_CONFIG.get("S3RetryBackoff", 0.2)
+
+# minio 或 local，local 将文件保存在本地目录，用于开发和压测
+STORAGE_BACKEND = _YAML_CONFIG.get("StorageBackend", "minio")
+LOCAL_STORAGE_DIR = _YAML_CONFIG.get("LocalStorageDir", BASE_DIR / "storage")
+LOCAL_STORAGE_URL = _YAML_CONFIG.get("LocalStorageUrl", "/api/file/local/")
+
+FLASH_SALE_WORKERS = _YAML_CONFIG.get("FlashSaleWorkers", 4)
+FLASH_SALE_QUEUE_SIZE = _YAML_CONFIG.get("FlashSaleQueueSize", 1000)
+FLASH_SALE_RESEED_SECONDS = _YAML_CONFIG.get("FlashSaleReseedSeconds", 5)
+
+THUMBNAIL_WORKERS = _YAML_CONFIG.get("ThumbnailWorkers", 2)
+THUMBNAIL_SIZE = _YAML_CONFIG.get("ThumbnailSize", 200)
+# 超过该大小的图片不生成缩略图，避免整个读入内存
+THUMBNAIL_MAX_SIZE = _YAML_CONFIG.get("ThumbnailMaxSize", 20 * 1024 * 1024)
+
+MULTIPART_UPLOAD_THRESHOLD = _YAML_CONFIG.get("MultipartUploadThreshold", 16 * 1024 * 1024)
+# s3 要求除最后一个分片外每个分片不小于 5MB
+MULTIPART_PART_SIZE = max(_YAML_CONFIG.get("MultipartPartSize", 8 * 1024 * 1024), 5 * 1024 * 1024)
+MULTIPART_UPLOAD_WORKERS = _YAML_CONFIG.get("MultipartUploadWorkers", 8)
+
+DOWNLOAD_CACHE_DIR = _YAML_CONFIG.get("DownloadCacheDir", None)
+DOWNLOAD_CACHE_SIZE = _YAML_CONFIG.get("DownloadCacheSize", 1024 * 1024 * 1024)
+
+# 商品、店铺图片和头像使用以内容哈希为键的公开 url，可以被浏览器和代理长期缓存
+PUBLIC_IMAGES = _YAML_CONFIG.get("PublicImages", False)
+PUBLIC_IMAGE_URL = _YAML_CONFIG.get("PublicImageUrl", "/api/image/public/")
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = "smtp.qq.com"
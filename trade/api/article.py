@@ -3,13 +3,13 @@ from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
 from trade.exceptions import InvalidOrderByException, InvalidFilterException
-from trade.file_util import s3_download_url
+from trade.file_util import public_image_url
 from trade.models.Article import Article
 from trade.models.ArticleOp import ARTICLE_OP_GOOD, ARTICLE_OP_COLLECT, ArticleOp
 from trade.models.Commodity import Commodity
 from trade.query_util import query_page, query_order_by, query_filter, filter_order_and_list
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, require_jwt, require_item_exist, require_keys, get_user, wrapped_api
+    filter_data, require_jwt, require_item_exist, require_item_fetch, require_keys, get_user, wrapped_api, FieldDict
 
 
 @response_wrapper
@@ -35,14 +35,13 @@ def user_new_article(request: HttpRequest):
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_item_exist(Article, "id", "query_id")
-def update_article(request: HttpRequest, query_id):
+@require_item_fetch(Article, "id", "query_id")
+def update_article(request: HttpRequest, article: Article):
     """
     [PUT] /api/article/<int:query_id>
     """
     user = get_user(request)
-    article = Article.objects.get(id=query_id)
-    if user != article.user:
+    if user.id != article.user_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
     data = parse_data(request)
     if data.get("commodity_id", None) is not None:
@@ -51,46 +50,45 @@ def update_article(request: HttpRequest, query_id):
         data["commodity"] = Commodity.objects.get(id=data["commodity_id"])
     filter_data(data, {"title", "content", "commodity"})
     try:
-        Article.objects.filter(id=query_id).update(**data)
+        Article.objects.filter(id=article.id).update(**data)
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
 
 
 def article_commodity_to_dict(commodity: Commodity) -> dict:
-    data = {
+    data = FieldDict({
         "id": commodity.id,
         "name": commodity.name,
         "price": commodity.price,
         "discount": commodity.discount,
-        "image_url": s3_download_url(commodity.image.oss_token),
-    }
+        "image_url": lambda: public_image_url(commodity.image, thumbnail=True),
+    })
     return data
 
 
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Article, "id", "query_id")
-def get_article_detail(request: HttpRequest, query_id):
+@require_item_fetch(Article, "id", "query_id", select_related=("user", "commodity__image"))
+def get_article_detail(request: HttpRequest, article: Article):
     """
     [GET] /api/article/<int:query_id>
     """
-    article = Article.objects.get(id=query_id)
     user = get_user(request)
-    data = {
+    data = FieldDict({
         "id": article.id,
         "title": article.title,
         "content": article.content,
         "post_time": article.post_time,
         "user_id": article.user.id,
         "user__nickname": article.user.nickname,
-        "star": ArticleOp.objects.filter(user=user, article_id=query_id, op=ARTICLE_OP_GOOD).exists(),
-        "collect": ArticleOp.objects.filter(user=user, article_id=query_id, op=ARTICLE_OP_COLLECT).exists(),
-        "star_count": get_article_star_count(article),
-        "collect_count": get_article_collect_count(article),
+        "star": lambda: ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_GOOD).exists(),
+        "collect": lambda: ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_COLLECT).exists(),
+        "star_count": lambda: get_article_star_count(article),
+        "collect_count": lambda: get_article_collect_count(article),
         "commodity": None if article.commodity is None else article_commodity_to_dict(article.commodity),
-    }
+    })
     return success_api_response(data)
 
 
@@ -104,22 +102,22 @@ def user_get_article_list(request: HttpRequest, *args, **kwargs):
     """
     [GET] /api/article/list
     """
-    articles = Article.objects.all()
+    articles = Article.objects.select_related("user")
     user = get_user(request)
 
     def user_brief_article_to_dict(article: Article) -> dict:
-        dic = {
+        dic = FieldDict({
             "id": article.id,
             "title": article.title,
             "content": article.content if len(article.content) < 200 else article.content[:198] + "...",
-            "user_id": article.user.id,
+            "user_id": article.user_id,
             "user__nickname": article.user.nickname,
             "post_time": article.post_time,
-            "star": ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_GOOD).exists(),
-            "collect": ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_COLLECT).exists(),
-            "star_count": get_article_star_count(article),
-            "collect_count": get_article_collect_count(article),
-        }
+            "star": lambda: ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_GOOD).exists(),
+            "collect": lambda: ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_COLLECT).exists(),
+            "star_count": lambda: get_article_star_count(article),
+            "collect_count": lambda: get_article_collect_count(article),
+        })
         return dic
 
     try:
@@ -132,17 +130,17 @@ def user_get_article_list(request: HttpRequest, *args, **kwargs):
 
 
 def admin_article_to_dict(article: Article) -> dict:
-    data = {
+    data = FieldDict({
         "id": article.id,
         "title": article.title,
-        "user_id": article.user.id,
+        "user_id": article.user_id,
         "user__nickname": article.user.nickname,
         "post_time": article.post_time,
-        "commodity_id": None if article.commodity is None else article.commodity.id,
+        "commodity_id": article.commodity_id,
         "commodity__name": None if article.commodity is None else article.commodity.name,
-        "star_count": get_article_star_count(article),
-        "collect_count": get_article_collect_count(article),
-    }
+        "star_count": lambda: get_article_star_count(article),
+        "collect_count": lambda: get_article_collect_count(article),
+    })
     return data
 
 
@@ -157,7 +155,7 @@ def admin_get_article_list(request: HttpRequest, *args, **kwargs):
     """
     [GET] /api/admin/article/list
     """
-    articles = Article.objects.all()
+    articles = Article.objects.select_related("user", "commodity")
     try:
         data = filter_order_and_list(articles, admin_article_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -238,21 +236,22 @@ def user_get_collect_article_list(request: HttpRequest, *args, **kwargs):
     user = get_user(request)
 
     def user_brief_article_to_dict(article: Article) -> dict:
-        dic = {
+        dic = FieldDict({
             "id": article.id,
             "title": article.title,
             "content": article.content if len(article.content) < 200 else article.content[:198] + "...",
-            "user_id": article.user.id,
+            "user_id": article.user_id,
             "user__nickname": article.user.nickname,
             "post_time": article.post_time,
-            "star": ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_GOOD).exists(),
-            "collect": ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_COLLECT).exists(),
-            "star_count": get_article_star_count(article),
-            "collect_count": get_article_collect_count(article),
-        }
+            "star": lambda: ArticleOp.objects.filter(user=user, article=article, op=ARTICLE_OP_GOOD).exists(),
+            "collect": True,
+            "star_count": lambda: get_article_star_count(article),
+            "collect_count": lambda: get_article_collect_count(article),
+        })
         return dic
 
-    article_op_list = ArticleOp.objects.filter(user=user, op=ARTICLE_OP_COLLECT).order_by("-op_time")
+    article_op_list = ArticleOp.objects.select_related("article__user") \
+        .filter(user=user, op=ARTICLE_OP_COLLECT).order_by("-op_time")
     page = kwargs.get("page")
     page_size = kwargs.get("page_size")
     paginator = Paginator(article_op_list, page_size)
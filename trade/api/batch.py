@@ -0,0 +1,100 @@
+import json
+import logging
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpRequest, JsonResponse, Http404
+from django.urls import resolve
+from django.views.decorators.http import require_POST
+
+from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
+    require_jwt, require_keys, share_auth, forget_user
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_REQUESTS = 20
+BATCH_METHODS = {"GET", "POST", "PUT", "DELETE"}
+
+
+def _build_sub_request(request: HttpRequest, method: str, url: str, body) -> HttpRequest:
+    """
+    build a sub-request which shares the headers and the authenticated user of the batch request
+    :param request: batch request
+    :param method: http method of sub-request
+    :param url: url of sub-request, query string is allowed
+    :param body: json body of sub-request
+    :return: sub-request
+    """
+    content = b"" if body is None else json.dumps(body).encode("utf-8")
+    split = urlsplit(url)
+    environ = request.META.copy()
+    # 幂等键属于整个批量请求，不能传给子请求
+    environ.pop("HTTP_IDEMPOTENCY_KEY", None)
+    environ.update({
+        "REQUEST_METHOD": method,
+        "PATH_INFO": split.path,
+        "QUERY_STRING": split.query,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(content)),
+        "wsgi.input": BytesIO(content),
+    })
+    sub_request = WSGIRequest(environ)
+    share_auth(request, sub_request)
+    return sub_request
+
+
+def _run_sub_request(request: HttpRequest, method: str, url: str, body) -> dict:
+    """
+    execute one sub-request against the url conf and return its status and json data
+    """
+    path = urlsplit(url).path
+    try:
+        match = resolve(path)
+    except Http404:
+        return {"status": 404, "data": failed_api_response(ErrorCode.NOT_FOUND_ERROR, "接口不存在")["data"]}
+    if match.func is batch:
+        return {"status": 400, "data": failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "不支持嵌套批量请求")["data"]}
+    sub_request = _build_sub_request(request, method, url, body)
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("批量请求的子请求出错: %s %s", method, url)
+        return {"status": 500, "data": {"code": 500, "detailed_error_code": 500_00, "error_msg": "服务器内部错误"}}
+    if not isinstance(response, JsonResponse):
+        return {"status": 400, "data": failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "该接口不支持批量请求")["data"]}
+    return {"status": response.status_code, "data": json.loads(response.content)}
+
+
+@response_wrapper
+@require_jwt()
+@require_POST
+@require_keys({"requests": [dict]})
+def batch(request: HttpRequest):
+    """
+    [POST] /api/batch
+    sub-requests are executed in order, identical GET sub-requests are executed only once until a non-GET
+    sub-request is executed, a non-GET sub-request also drops the shared user which it may have modified
+    """
+    sub_requests = parse_data(request)["requests"]
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS,
+                                   "单次最多包含{}个请求".format(BATCH_MAX_REQUESTS))
+    for sub in sub_requests:
+        if not isinstance(sub.get("url"), str) or sub.get("method", "GET") not in BATCH_METHODS:
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "子请求格式错误")
+
+    get_cache = {}
+    results = []
+    for sub in sub_requests:
+        method = sub.get("method", "GET")
+        url = sub["url"]
+        if method == "GET":
+            if url not in get_cache:
+                get_cache[url] = _run_sub_request(request, method, url, None)
+            results.append(get_cache[url])
+        else:
+            get_cache.clear()
+            results.append(_run_sub_request(request, method, url, sub.get("body")))
+            forget_user(request)
+    return success_api_response({"results": results})
@@ -1,80 +1,75 @@
+from django.db import transaction
 from django.db.models import Avg
 from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_POST
 
 from trade.exceptions import InvalidOrderByException, InvalidFilterException
-from trade.file_util import s3_download_url
-from trade.models.Comment import Order, Comment
+from trade.api.order import order_transition_failed
+from trade.file_util import s3_download_url, thumbnail_oss_token, public_image_url
+from trade.models.Comment import Comment
 from trade.models.Commodity import Commodity
-from trade.models.status import ORDER_STATUS_CONFIRMED, ORDER_STATUS_COMMENTED
+from trade.order_util import transit_order
 from trade.query_util import query_page, query_order_by, query_filter, filter_order_and_list
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, require_jwt, require_item_exist, require_keys, get_user
+    filter_data, require_jwt, require_item_exist, require_item_fetch, require_keys, get_user, FieldDict
 
 
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"grade", "images"})
-@require_item_exist(Order, "id", "query_id")
-def comment_order(request: HttpRequest, query_id):
+@require_keys({"grade": int, "images": [int]})
+def comment_order(request: HttpRequest, query_id: int):
     """
     [POST] /api/order/comment/<int:query_id>
     """
-    order = Order.objects.get(id=query_id)
-    if get_user(request) != order.user:
-        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
-    if order.status != ORDER_STATUS_CONFIRMED:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单状态出出错")
-    order.status = ORDER_STATUS_COMMENTED
-    order.save()
     data = parse_data(request)
     images = data["images"]
     filter_data(data, {"grade", "content"})
-    data["order"] = order
-    comment = Comment.objects.create(**data)
-    for image_id in images:
-        comment.image_set.add(image_id)
+    with transaction.atomic():
+        if not transit_order(query_id, "comment", user_id=get_user(request).id):
+            return order_transition_failed(query_id, get_user(request).id)
+        comment = Comment.objects.create(order_id=query_id, **data)
+        comment.image_set.add(*images)
     return success_api_response({"id": comment.id})
 
 
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Comment, "id", "query_id")
-def get_comment_detail(request: HttpRequest, query_id):
+@require_item_fetch(Comment, "id", "query_id", select_related=("order__user",),
+                    prefetch_related=("order__select_paras", "image_set"))
+def get_comment_detail(request: HttpRequest, comment: Comment):
     """
     [GET] /api/comment/<int:query_id>
     """
-    comment = Comment.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "id": comment.id,
         "order_id": comment.order.id,
         "order__price": comment.order.price,
         "order__num": comment.order.num,
         "order__user_id": comment.order.user.id,
         "order__user__nickname": comment.order.user.nickname,
-        "parameters": list(map(lambda x: x.description, comment.order.select_paras.all())),
+        "parameters": lambda: list(map(lambda x: x.description, comment.order.select_paras.all())),
         "grade": comment.grade,
         "content": comment.content,
         "comment_time": comment.comment_time,
-        "image_urls": list(map(lambda x: s3_download_url(x.oss_token), comment.image_set.all())),
-    }
+        "image_urls": lambda: list(map(lambda x: s3_download_url(x.oss_token), comment.image_set.all())),
+    })
     return success_api_response(data)
 
 
 def comment_to_dict(comment: Comment) -> dict:
-    data = {
+    data = FieldDict({
         "id": comment.id,
         "order__user__nickname": comment.order.user.nickname,
         "grade": comment.grade,
         "content": comment.content,
         "comment_time": comment.comment_time,
-        "parameters": list(map(lambda x: x.description, comment.order.select_paras.all())),
-        "image_urls": list(map(lambda x: s3_download_url(x.oss_token), comment.image_set.all())),
-        "user_image_url": None if comment.order.user.image is None else s3_download_url(
-            comment.order.user.image.oss_token),
-    }
+        "parameters": lambda: list(map(lambda x: x.description, comment.order.select_paras.all())),
+        "image_urls": lambda: list(map(lambda x: s3_download_url(thumbnail_oss_token(x)), comment.image_set.all())),
+        "user_image_url": lambda: None if comment.order.user.image is None else public_image_url(
+            comment.order.user.image, thumbnail=True),
+    })
     return data
 
 
@@ -89,7 +84,7 @@ def get_commodity_comment_list(request: HttpRequest, query_id, *args, **kwargs):
     """
     [GET] /api/commodity/comment/list/<int:query_id>
     """
-    comments = Comment.objects.filter(order__commodity_id=query_id)
+    comments = Comment.objects.select_related("order__user__image").filter(order__commodity_id=query_id)
     try:
         data = filter_order_and_list(comments, comment_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -106,6 +101,17 @@ def get_commodity_avg_grade(commodity_id: int):
     return comments.aggregate(Avg("grade"))["grade__avg"]
 
 
+def get_commodity_avg_grades(commodity_ids) -> dict:
+    """
+    get average grades of several commodities in one query
+    :param commodity_ids: iterable of commodity id
+    :return: dict maps commodity id to average grade, commodities without comment are not included
+    """
+    grades = Comment.objects.filter(order__commodity_id__in=commodity_ids).values("order__commodity_id") \
+        .annotate(grade=Avg("grade")).values_list("order__commodity_id", "grade")
+    return dict(grades)
+
+
 @response_wrapper
 @require_jwt()
 @require_GET
@@ -119,7 +125,7 @@ def get_commodity_grade(request: HttpRequest, query_id):
 
 
 def admin_comment_to_dict(comment: Comment) -> dict:
-    data = {
+    data = FieldDict({
         "id": comment.id,
         "order__user_id": comment.order.user.id,
         "order__user__nickname": comment.order.user.nickname,
@@ -129,7 +135,7 @@ def admin_comment_to_dict(comment: Comment) -> dict:
         "order__commodity__shop__name": comment.order.commodity.shop.name,
         "grade": comment.grade,
         "comment_time": comment.comment_time,
-    }
+    })
     return data
 
 
@@ -145,7 +151,7 @@ def admin_get_comment_list(requestL: HttpRequest, *args, **kwargs):
     """
     [GET] /api/admin/comment/list
     """
-    comments = Comment.objects.all()
+    comments = Comment.objects.select_related("order__user", "order__commodity__shop")
     try:
         data = filter_order_and_list(comments, admin_comment_to_dict, **kwargs)
     except InvalidOrderByException:
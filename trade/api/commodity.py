@@ -1,11 +1,15 @@
+from decimal import Decimal
+from functools import cache
+
 from django.core.paginator import Paginator
 from django.db.models import Q, F, ProtectedError
 from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
-from trade.api.comment import get_commodity_avg_grade
+from trade.api.comment import get_commodity_avg_grade, get_commodity_avg_grades
 from trade.api.shop import get_shop_avg_grade
-from trade.file_util import s3_download_url
+from trade.file_util import public_image_url, public_image_urls
+from trade.flash_sale import stock_tokens
 from trade.models.CommCollectRecord import CommCollectRecord
 from trade.models.Commodity import Commodity
 from trade.models.File import File
@@ -14,32 +18,36 @@ from trade.models.ParaSet import ParaSet
 from trade.models.Parameter import Parameter
 from trade.models.Shop import Shop
 from trade.models.status import COMM_STATUS_ON_SELL, COMM_STATUS_PRE_SELL, COMM_STATUS_INVALID
-from trade.query_util import query_page
+from trade.order_util import get_sale, set_sale_shards
+from trade.query_util import query_page, query_ids
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, wrapped_api, require_jwt, require_item_exist, require_keys, get_user
+    filter_data, wrapped_api, require_jwt, require_item_exist, require_item_fetch, require_keys, get_user, FieldDict
+
+MAX_SALE_SHARDS = 64
 
 
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"name", "total", "price", "discount", "method", "image_id", "status", "para_set", "introduction"})
-@require_item_exist(Shop, "id", "query_id")
-def add_commodity(request: HttpRequest, query_id):
+@require_keys({"name": str, "total": int, "price": Decimal, "discount": Decimal, "method": int, "image_id": [int],
+               "status": int, "para_set": [dict], "introduction": str})
+@require_item_fetch(Shop, "id", "query_id")
+def add_commodity(request: HttpRequest, shop: Shop):
     """
     [POST] /api/shop/comm/add/<int:query_id>
     para_set example:
     [{"name":"颜色","options":{"红色":0.00,"蓝色":0.00}},{"name":"大小","options":{"小":0.00,"大":10.00}}]
     """
     user = get_user(request)
-    shop = Shop.objects.get(id=query_id)
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
     if not File.objects.filter(id=data["image_id"][0]).exists():
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "图片不存在！")
     image = File.objects.get(id=data["image_id"][0])
     other_image = [data["image_id"][i] for i in range(1, len(data["image_id"]))]
-    filter_data(data, {"name", "introduction", "status", "total", "price", "discount", "method", "para_set"})
+    filter_data(data, {"name", "introduction", "status", "total", "price", "discount", "method", "para_set",
+                       "flash_sale"})
     if data.get("status", None) is not None and \
             data["status"] not in (COMM_STATUS_INVALID, COMM_STATUS_PRE_SELL, COMM_STATUS_ON_SELL):
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "商品初始状态错误")
@@ -75,7 +83,7 @@ def para_to_dict(parameter: Parameter) -> dict:
 
 
 def para_set_to_dict(para_set: ParaSet) -> dict:
-    paras = Parameter.objects.filter(para_set=para_set)
+    paras = para_set.parameter_set.all()
     data = {
         "id": para_set.id,
         "name": para_set.name,
@@ -87,18 +95,18 @@ def para_set_to_dict(para_set: ParaSet) -> dict:
 @response_wrapper
 @require_jwt()
 @require_http_methods(["DELETE"])
-@require_item_exist(Commodity, "id", "query_id")
-def delete_commodity(request: HttpRequest, query_id):
+@require_item_fetch(Commodity, "id", "query_id", select_related=("shop",))
+def delete_commodity(request: HttpRequest, commodity: Commodity):
     """
     [DELETE] /api/comm/<int:query_id>
     """
     user = get_user(request)
-    shop = Commodity.objects.get(id=query_id).shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     try:
-        Commodity.objects.filter(id=query_id).delete()
-        Log.objects.create(user=user, detail="删除商品ID:{}".format(query_id))
+        Commodity.objects.filter(id=commodity.id).delete()
+        Log.objects.create(user=user, detail="删除商品ID:{}".format(commodity.id))
         return success_api_response()
     except ProtectedError:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "存在与之关联的订单，不能删除")
@@ -109,53 +117,98 @@ def delete_commodity(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Commodity, "id", "query_id")
-def get_commodity_detail(request: HttpRequest, query_id):
+@require_item_fetch(Commodity, "id", "query_id", select_related=("shop", "image"),
+                    prefetch_related=("image_set", "paraset_set__parameter_set"))
+def get_commodity_detail(request: HttpRequest, commodity: Commodity):
     """
     [GET] /api/comm/<int:query_id>
     """
-    commodity = Commodity.objects.get(id=query_id)
-    para_sets = ParaSet.objects.filter(commodity=commodity)
+    para_sets = commodity.paraset_set.all()
     user = get_user(request)
-    data = {
+    data = FieldDict({
         "id": commodity.id,
         "name": commodity.name,
         "introduction": commodity.introduction,
         "status": commodity.status,
         "total": commodity.total,
-        "sale": commodity.sale,
+        "sale": lambda: get_sale(commodity),
         "price": commodity.price,
         "discount": commodity.discount,
         "shop_id": commodity.shop.id,
         "shop__name": commodity.shop.name,
-        "shop__grade": get_shop_avg_grade(commodity.shop.id),
+        "shop__grade": lambda: get_shop_avg_grade(commodity.shop.id),
         "method": commodity.method,
-        "parameters": list(map(para_set_to_dict, para_sets)),
-        "img_url": s3_download_url(commodity.image.oss_token),
-        "img_url_list": list(map(lambda x: s3_download_url(x.oss_token), commodity.image_set.all())),
-        "grade": get_commodity_avg_grade(query_id),
-        "collect": CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
-    }
+        "flash_sale": commodity.flash_sale,
+        "parameters": lambda: list(map(para_set_to_dict, para_sets)),
+        "img_url": lambda: public_image_url(commodity.image),
+        "img_url_list": lambda: list(map(public_image_url, commodity.image_set.all())),
+        "grade": lambda: get_commodity_avg_grade(commodity.id),
+        "collect": lambda: CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
+    })
     return success_api_response(data)
 
 
+@response_wrapper
+@require_jwt()
+@require_GET
+@query_ids(max_count=50)
+def multi_get_commodity(request: HttpRequest, *args, **kwargs):
+    """
+    [GET] /api/comm/multi?ids=1,2,3
+    返回以商品id为键的字典，不存在的id不包含在结果中
+    """
+    ids = kwargs.get("ids")
+    user = get_user(request)
+    commodities = list(Commodity.objects.select_related("shop", "image").filter(id__in=ids))
+    grades = cache(lambda: get_commodity_avg_grades(ids))
+    urls = cache(lambda: public_image_urls((commodity.image for commodity in commodities), thumbnail=True))
+    collects = cache(lambda: set(CommCollectRecord.objects.filter(user=user, commodity_id__in=ids)
+                                 .values_list("commodity_id", flat=True)))
+
+    def multi_commodity_to_dict(commodity: Commodity) -> dict:
+        return FieldDict({
+            "id": commodity.id,
+            "name": commodity.name,
+            "introduction": commodity.introduction,
+            "status": commodity.status,
+            "total": commodity.total,
+            "sale": commodity.sale,
+            "price": commodity.price,
+            "discount": commodity.discount,
+            "shop_id": commodity.shop_id,
+            "shop__name": commodity.shop.name,
+            "method": commodity.method,
+            "img_url": lambda: urls()[commodity.image_id],
+            "grade": lambda: grades().get(commodity.id),
+            "collect": lambda: commodity.id in collects(),
+        })
+
+    return success_api_response({commodity.id: multi_commodity_to_dict(commodity) for commodity in commodities})
+
+
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_item_exist(Commodity, "id", "query_id")
-def update_commodity_detail(request: HttpRequest, query_id):
+@require_item_fetch(Commodity, "id", "query_id", select_related=("shop",))
+def update_commodity_detail(request: HttpRequest, commodity: Commodity):
     """
     [PUT] /api/comm/<int:query_id>
     """
     user = get_user(request)
-    shop = Commodity.objects.get(id=query_id).shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
-    filter_data(data, {"status", "discount"})
+    filter_data(data, {"status", "discount", "flash_sale", "sale_shards"})
+    sale_shards = data.pop("sale_shards", None)
+    if sale_shards is not None and (not isinstance(sale_shards, int) or not 0 <= sale_shards <= MAX_SALE_SHARDS):
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "分片数应为0~{}的整数".format(MAX_SALE_SHARDS))
     try:
-        Commodity.objects.filter(id=query_id).update(**data)
-        Log.objects.create(user=user, detail="更新商品ID:{}".format(query_id))
+        Commodity.objects.filter(id=commodity.id).update(**data)
+        if sale_shards is not None and sale_shards != commodity.sale_shards:
+            set_sale_shards(commodity, sale_shards)
+        stock_tokens.invalidate(commodity.id)
+        Log.objects.create(user=user, detail="更新商品ID:{}".format(commodity.id))
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, str(exception))
@@ -164,35 +217,35 @@ def update_commodity_detail(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_http_methods(["DELETE"])
-@require_item_exist(Parameter, "id", "query_id")
-def delete_parameter(request: HttpRequest, query_id):
+@require_item_fetch(Parameter, "id", "query_id", select_related=("para_set__commodity__shop",))
+def delete_parameter(request: HttpRequest, parameter: Parameter):
     """
     [DELETE] /api/comm/para/<int:query_id>
     """
     user = get_user(request)
-    shop = Parameter.objects.get(id=query_id).para_set.commodity.shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = parameter.para_set.commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
-    Parameter.objects.get(id=query_id).delete()
+    parameter.delete()
     return success_api_response()
 
 
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_item_exist(Parameter, "id", "query_id")
-def update_parameter(request: HttpRequest, query_id):
+@require_item_fetch(Parameter, "id", "query_id", select_related=("para_set__commodity__shop",))
+def update_parameter(request: HttpRequest, parameter: Parameter):
     """
     [PUT] /api/comm/para/<int:query_id>
     """
     user = get_user(request)
-    shop = Parameter.objects.get(id=query_id).para_set.commodity.shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = parameter.para_set.commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
     filter_data(data, {"description", "add"})
     try:
-        Parameter.objects.filter(id=query_id).update(**data)
+        Parameter.objects.filter(id=parameter.id).update(**data)
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, str(exception))
@@ -201,16 +254,15 @@ def update_parameter(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"description", "add"})
-@require_item_exist(ParaSet, "id", "query_id")
-def add_parameter(request: HttpRequest, query_id):
+@require_keys({"description": str, "add": Decimal})
+@require_item_fetch(ParaSet, "id", "query_id", select_related=("commodity__shop",))
+def add_parameter(request: HttpRequest, para_set: ParaSet):
     """
     [POST] /api/comm/para/add_to_para_set/<int:query_id>
     """
     user = get_user(request)
-    para_set = ParaSet.objects.get(id=query_id)
     shop = para_set.commodity.shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
     filter_data(data, {"description", "add"})
@@ -222,36 +274,36 @@ def add_parameter(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_http_methods(["DELETE"])
-@require_item_exist(ParaSet, "id", "query_id")
-def delete_para_set(request: HttpRequest, query_id):
+@require_item_fetch(ParaSet, "id", "query_id", select_related=("commodity__shop",))
+def delete_para_set(request: HttpRequest, para_set: ParaSet):
     """
     [DELETE] /api/comm/para_set/<int:query_id>
     """
     user = get_user(request)
-    shop = ParaSet.objects.get(id=query_id).commodity.shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = para_set.commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
-    Parameter.objects.filter(para_set_id=query_id).delete()
-    ParaSet.objects.filter(id=query_id).delete()
+    Parameter.objects.filter(para_set_id=para_set.id).delete()
+    ParaSet.objects.filter(id=para_set.id).delete()
     return success_api_response()
 
 
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_item_exist(ParaSet, "id", "query_id")
-def update_para_set(request: HttpRequest, query_id):
+@require_item_fetch(ParaSet, "id", "query_id", select_related=("commodity__shop",))
+def update_para_set(request: HttpRequest, para_set: ParaSet):
     """
     [PUT] /api/comm/para_set/<int:query_id>
     """
     user = get_user(request)
-    shop = ParaSet.objects.get(id=query_id)
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = para_set.commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
     filter_data(data, {"name"})
     try:
-        ParaSet.objects.filter(id=query_id).update(**data)
+        ParaSet.objects.filter(id=para_set.id).update(**data)
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, str(exception))
@@ -260,16 +312,15 @@ def update_para_set(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"name"})
-@require_item_exist(Commodity, "id", "query_id")
-def add_para_set(request: HttpRequest, query_id):
+@require_keys({"name": str})
+@require_item_fetch(Commodity, "id", "query_id", select_related=("shop",))
+def add_para_set(request: HttpRequest, commodity: Commodity):
     """
     [POST] /api/comm/para_set/add_to_comm/<int:query_id>
     """
     user = get_user(request)
-    commodity = Commodity.objects.get(id=query_id)
-    shop = commodity.get(id=query_id).shop
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    shop = commodity.shop
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     data = parse_data(request)
     filter_data(data, {"name"})
@@ -281,7 +332,7 @@ def add_para_set(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"keyword"})
+@require_keys({"keyword": str})
 @query_page(default=10)
 def user_get_commodity(request: HttpRequest, *args, **kwargs):
     """
@@ -293,7 +344,7 @@ def user_get_commodity(request: HttpRequest, *args, **kwargs):
     user = get_user(request)
 
     def user_commodity_to_dict(commodity: Commodity) -> dict:
-        dic = {
+        dic = FieldDict({
             "id": commodity.id,
             "name": commodity.name,
             "introduction": commodity.introduction,
@@ -302,17 +353,17 @@ def user_get_commodity(request: HttpRequest, *args, **kwargs):
             "sale": commodity.sale,
             "price": commodity.price,
             "discount": commodity.discount,
-            "shop_id": commodity.shop.id,
+            "shop_id": commodity.shop_id,
             "shop__name": commodity.shop.name,
             "method": commodity.method,
-            "img_url": s3_download_url(commodity.image.oss_token),
-            "grade": get_commodity_avg_grade(commodity.id),
-            "collect": CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
-        }
+            "img_url": lambda: public_image_url(commodity.image, thumbnail=True),
+            "grade": lambda: get_commodity_avg_grade(commodity.id),
+            "collect": lambda: CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
+        })
         return dic
 
     filter_data(data, {"keyword", "min_price", "status", "max_price", "method", "min_sale", "have_stock", "order_by"})
-    commodities = Commodity.objects.filter(
+    commodities = Commodity.objects.select_related("shop", "image").filter(
         Q(name__contains=data["keyword"]) | Q(introduction__contains=data["keyword"]) | Q(
             shop__name__contains=data["keyword"]))
     if data.get("min_price", None) is not None:
@@ -353,18 +404,17 @@ def user_get_commodity(request: HttpRequest, *args, **kwargs):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"keyword"})
-@require_item_exist(Shop, "id", "query_id")
+@require_keys({"keyword": str})
+@require_item_fetch(Shop, "id", "query_id")
 @query_page(default=10)
-def user_get_shop_commodity_list(request: HttpRequest, query_id, *args, **kwargs):
+def user_get_shop_commodity_list(request: HttpRequest, shop: Shop, *args, **kwargs):
     """
     [POST] /api/shop/comm/list/<int:query_id>
     """
-    shop = Shop.objects.get(id=query_id)
     user = get_user(request)
 
     def user_commodity_to_dict(commodity: Commodity) -> dict:
-        dic = {
+        dic = FieldDict({
             "id": commodity.id,
             "name": commodity.name,
             "introduction": commodity.introduction,
@@ -374,13 +424,13 @@ def user_get_shop_commodity_list(request: HttpRequest, query_id, *args, **kwargs
             "price": commodity.price,
             "discount": commodity.discount,
             "method": commodity.method,
-            "img_url": s3_download_url(commodity.image.oss_token),
-            "grade": get_commodity_avg_grade(commodity.id),
-            "collect": CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
-        }
+            "img_url": lambda: public_image_url(commodity.image, thumbnail=True),
+            "grade": lambda: get_commodity_avg_grade(commodity.id),
+            "collect": lambda: CommCollectRecord.objects.filter(user=user, commodity=commodity).exists(),
+        })
         return dic
 
-    commodities = Commodity.objects.filter(shop=shop)
+    commodities = Commodity.objects.select_related("image").filter(shop=shop)
     data = parse_data(request)
     filter_data(data, {"keyword", "min_price", "status", "max_price", "method", "min_sale", "have_stock", "order_by"})
     if data.get("keyword", None) is not None:
@@ -452,7 +502,7 @@ def user_cancel_collect_commodity(request: HttpRequest, query_id):
 
 def user_collect_commodity_record_to_dict(record: CommCollectRecord) -> dict:
     commodity = record.commodity
-    data = {
+    data = FieldDict({
         "id": commodity.id,
         "name": commodity.name,
         "introduction": commodity.introduction,
@@ -461,12 +511,12 @@ def user_collect_commodity_record_to_dict(record: CommCollectRecord) -> dict:
         "sale": commodity.sale,
         "price": commodity.price,
         "discount": commodity.discount,
-        "shop_id": commodity.shop.id,
+        "shop_id": commodity.shop_id,
         "shop__name": commodity.shop.name,
         "method": commodity.method,
-        "img_url": s3_download_url(commodity.image.oss_token),
-        "grade": get_commodity_avg_grade(commodity.id),
-    }
+        "img_url": lambda: public_image_url(commodity.image, thumbnail=True),
+        "grade": lambda: get_commodity_avg_grade(commodity.id),
+    })
     return data
 
 
@@ -479,7 +529,8 @@ def user_get_collect_commodity_list(request: HttpRequest, *args, **kwargs):
     [GET] /api/comm/collect/list
     """
     user = get_user(request)
-    records = CommCollectRecord.objects.filter(user=user).order_by("-op_time")
+    records = CommCollectRecord.objects.select_related("commodity__shop", "commodity__image").filter(user=user) \
+        .order_by("-op_time")
     tot_count = records.count()
     page = kwargs.get("page")
     page_size = kwargs.get("page_size")
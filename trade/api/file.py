@@ -1,15 +1,28 @@
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpRequest
-from django.views.decorators.http import require_POST, require_GET
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.views.decorators.http import require_POST, require_GET, require_http_methods
 
-from trade.file_util import s3_download, s3_upload, s3_download_url, _validate_upload_file, get_oss_token
+from DBProject.settings import PUBLIC_IMAGES
+from trade.file_util import s3_download, s3_upload, s3_download_url, s3_download_urls, _validate_upload_file, \
+    get_oss_token, s3_upload_url, s3_stat, s3_remove, s3_sha256_image_type, file_sha256, file_image_type, \
+    get_thumbnail_token
+from trade.http_pool import storage_metrics
 from trade.models.Log import Log
 from trade.models.Comment import Comment
 from trade.models.Commodity import Commodity
 from trade.models.File import File
 from trade.models.Shop import Shop
+from trade.models.User import User
+from trade.models.status import FILE_STATUS_PENDING, FILE_STATUS_ACTIVE
+from trade.query_util import query_ids
+from trade.storage import get_storage, LocalStorage
+from trade.thumbnail import generate_thumbnail
+from trade.upload_handler import multipart_upload, S3UploadedFile
 from trade.util import response_wrapper, success_api_response, failed_api_response, ErrorCode, \
-    require_jwt, require_item_exist, validate_request, get_user, require_keys, parse_data
+    require_jwt, require_item_exist, require_item_fetch, validate_request, get_user, require_keys, parse_data
 
 
 @response_wrapper
@@ -30,7 +43,7 @@ def set_user_image(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"shop_id"})
+@require_keys({"shop_id": int})
 @require_item_exist(File, "id", "query_id")
 def set_shop_image(request: HttpRequest, query_id):
     """
@@ -57,7 +70,7 @@ def check_image_ids(images: list[int]) -> bool:
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"comment_id", "image_id_list"})
+@require_keys({"comment_id": int, "image_id_list": [int]})
 def add_comment_image(request: HttpRequest):
     """
     [POST] /api/image/comment
@@ -79,7 +92,7 @@ def add_comment_image(request: HttpRequest):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"commodity_id", "image_id_list"})
+@require_keys({"commodity_id": int, "image_id_list": [int]})
 def add_commodity_image(request: HttpRequest):
     """
     [POST] /api/image/commodity
@@ -102,7 +115,7 @@ def add_commodity_image(request: HttpRequest):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_keys({"commodity_id"})
+@require_keys({"commodity_id": int})
 @require_item_exist(File, "id", "query_id")
 def set_commodity_main_image(request: HttpRequest, query_id):
     """
@@ -125,35 +138,111 @@ def set_commodity_main_image(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
+@multipart_upload
 @validate_request(func=_validate_upload_file)
 def upload_file(request: HttpRequest):
     """
     [POST] /api/file/upload
     """
     user = get_user(request)
+    upload = request.FILES["file"]
+    # 大文件在解析请求时已经分片上传到对象存储
+    streamed = isinstance(upload, S3UploadedFile)
     try:
-        filename = request.FILES.get("file").name
-        data = {
-            "filename": filename,
-            "oss_token": get_oss_token(user.id, filename),
-        }
-        s3_upload(data["oss_token"], request)
+        content_hash = upload.content_hash if streamed else file_sha256(upload)
+        image_type = upload.image_type if streamed else file_image_type(upload)
+        # 内容相同的文件已存在时新建一条记录共享已有的对象，文件名属于本次上传。
+        # 锁住被共享的记录直到新记录提交，gc_files 删除记录后会看到新记录而保留对象
+        with transaction.atomic():
+            shared = File.objects.select_for_update().filter(content_hash=content_hash) \
+                .values("oss_token", "has_thumbnail").first()
+            if shared is not None:
+                file = File.objects.create(filename=upload.name, content_hash=content_hash, image_type=image_type,
+                                           **shared)
+        oss_token = upload.oss_token if streamed else get_oss_token(user.id, upload.name)
+        if shared is None and not streamed:
+            s3_upload(oss_token, request)
     except Exception as exception:
+        if streamed:
+            # 分片上传的对象还没有被记录引用
+            s3_remove(upload.oss_token)
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
-    file = File.objects.create(**data)
+    if shared is not None:
+        if streamed:
+            s3_remove(upload.oss_token)
+        return success_api_response({"id": file.id})
+    file = File.objects.create(filename=upload.name, oss_token=oss_token, content_hash=content_hash,
+                               image_type=image_type)
+    generate_thumbnail(file)
+    return success_api_response({"id": file.id})
+
+
+@response_wrapper
+@require_jwt()
+@require_POST
+@require_keys({"filename": str})
+def init_upload_file(request: HttpRequest):
+    """
+    [POST] /api/file/upload/init
+    前端使用返回的 url 直接 PUT 文件到对象存储，上传完成后调用 /api/file/upload/complete
+    """
+    user = get_user(request)
+    filename = parse_data(request)["filename"]
+    if len(filename) == 0 or len(filename) > File._meta.get_field("filename").max_length:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "文件名长度不合法")
+    oss_token = get_oss_token(user.id, filename)
+    try:
+        url = s3_upload_url(oss_token)
+    except Exception as exception:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
+    file = File.all_objects.create(filename=filename, oss_token=oss_token, status=FILE_STATUS_PENDING)
+    return success_api_response({"id": file.id, "url": url})
+
+
+@response_wrapper
+@require_jwt()
+@require_POST
+@require_keys({"id": int})
+def complete_upload_file(request: HttpRequest):
+    """
+    [POST] /api/file/upload/complete
+    """
+    user = get_user(request)
+    file_id = parse_data(request)["id"]
+    try:
+        file = File.all_objects.get(id=file_id)
+    except ObjectDoesNotExist:
+        return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "文件不存在")
+    # oss_token 以上传者 id 开头
+    if not file.oss_token.startswith("{}/".format(user.id)):
+        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
+    if file.status == FILE_STATUS_ACTIVE:
+        return success_api_response({"id": file.id})
+    try:
+        stat = s3_stat(file.oss_token)
+        if stat is None:
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "文件尚未上传")
+        # 直传的文件不经过服务器，完成时读取一遍对象计算内容哈希和图片类型
+        content_hash, image_type = s3_sha256_image_type(file.oss_token)
+    except Exception as exception:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
+    if File.all_objects.filter(id=file.id, status=FILE_STATUS_PENDING) \
+            .update(status=FILE_STATUS_ACTIVE, upload_time=timezone.now(), content_hash=content_hash,
+                    image_type=image_type) > 0:
+        file.content_hash, file.image_type = content_hash, image_type
+        generate_thumbnail(file)
     return success_api_response({"id": file.id})
 
 
 @response_wrapper
 @require_GET
-@require_item_exist(File, "id", "query_id")
-def download_file(request: HttpRequest, query_id):
+@require_item_fetch(File, "id", "query_id")
+def download_file(request: HttpRequest, file: File):
     """
     [GET] /api/file/download/<int:query_id>
     """
-    file = File.objects.get(id=query_id)
     try:
-        response = s3_download(file.oss_token, file.filename)
+        response = s3_download(file.oss_token, file.filename, request.META.get("HTTP_RANGE", None))
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, str(exception))
     return response
@@ -162,10 +251,104 @@ def download_file(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(File, "id", "query_id")
-def get_file_url(request: HttpRequest, query_id):
+@require_item_fetch(File, "id", "query_id")
+def get_file_url(request: HttpRequest, file: File):
     """
     [GET] /api/file/url/<int:query_id>
     """
-    file = File.objects.get(id=query_id)
     return success_api_response({"url": s3_download_url(file.oss_token)})
+
+
+@response_wrapper
+@require_jwt()
+@require_GET
+@query_ids(max_count=50)
+def multi_get_file_url(request: HttpRequest, *args, **kwargs):
+    """
+    [GET] /api/file/url/multi?ids=1,2,3
+    返回以文件id为键的字典，不存在的id不包含在结果中
+    """
+    files = list(File.objects.filter(id__in=kwargs.get("ids")).only("id", "oss_token"))
+    urls = s3_download_urls(file.oss_token for file in files)
+    return success_api_response({file.id: {"url": urls[file.oss_token]} for file in files})
+
+
+PUBLIC_IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _public_image_condition():
+    # 只公开商品图片、店铺图片和头像，学生认证等图片仍然只能通过预签名 url 访问
+    return Exists(User.objects.filter(image=OuterRef("pk"))) | \
+        Exists(Shop.objects.filter(image=OuterRef("pk"))) | \
+        Exists(Commodity.objects.filter(image=OuterRef("pk"))) | \
+        Exists(Commodity.image_set.through.objects.filter(file=OuterRef("pk")))
+
+
+@response_wrapper
+@require_GET
+def get_public_image(request: HttpRequest, content_hash: str, thumbnail: bool = False):
+    """
+    [GET] /api/image/public/<str:content_hash>
+    [GET] /api/image/public/<str:content_hash>/thumb
+    url 由文件内容决定，内容不变 url 就不变，所以允许浏览器和代理永久缓存
+    """
+    file = None
+    if PUBLIC_IMAGES:
+        # 只内联展示文件头确认过的图片，上传的 html、svg 等文件不能在 api 域名下被浏览器执行
+        file = File.objects.filter(_public_image_condition(), content_hash=content_hash, image_type__isnull=False) \
+            .first()
+    if file is None or (thumbnail and not file.has_thumbnail):
+        return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "图片不存在")
+    etag = '"{}{}"'.format(content_hash, "-thumb" if thumbnail else "")
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            if thumbnail:
+                response = s3_download(get_thumbnail_token(file.oss_token), "thumb.webp",
+                                       request.META.get("HTTP_RANGE", None))
+            else:
+                response = s3_download(file.oss_token, file.filename, request.META.get("HTTP_RANGE", None))
+        except Exception as exception:
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, str(exception))
+        if response.status_code not in (200, 206):
+            return response
+        response["Content-Type"] = "image/webp" if thumbnail else file.image_type
+        response["X-Content-Type-Options"] = "nosniff"
+        del response["Content-Disposition"]
+    response["ETag"] = etag
+    response["Cache-Control"] = PUBLIC_IMAGE_CACHE_CONTROL
+    return response
+
+
+@response_wrapper
+@require_jwt(admin=True)
+@require_GET
+def admin_get_storage_metrics(request: HttpRequest):
+    """
+    [GET] /api/admin/storage/metrics
+    当前进程访问对象存储的统计数据
+    """
+    return success_api_response(storage_metrics.snapshot())
+
+
+@response_wrapper
+@require_http_methods(["GET", "PUT"])
+def local_file(request: HttpRequest, oss_token: str):
+    """
+    [GET/PUT] /api/file/local/<path:oss_token>?expires=xxx&signature=xxx
+    使用本地存储时代替对象存储的预签名 url
+    """
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage) or \
+            not storage.verify(request.method, oss_token, request.GET.get("expires"), request.GET.get("signature")):
+        return failed_api_response(ErrorCode.REFUSE_ACCESS_ERROR, "签名无效或已过期")
+    try:
+        if request.method == "PUT":
+            storage.put_object(oss_token, request, int(request.META.get("CONTENT_LENGTH") or 0))
+            return HttpResponse()
+        return s3_download(oss_token, oss_token.rsplit("/", 1)[-1], request.META.get("HTTP_RANGE", None))
+    except FileNotFoundError:
+        return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "文件不存在")
+    except ValueError as exception:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
@@ -1,76 +1,74 @@
-from django.db import connection
 from django.http import HttpRequest
 from django.utils import timezone
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
-from trade.exceptions import InvalidOrderByException, InvalidFilterException
-from trade.file_util import s3_download_url
+from trade.exceptions import InvalidOrderByException, InvalidFilterException, OrderException
+from trade.file_util import public_image_url
+from trade.flash_sale import flash_sale_place_order, stock_tokens
 from trade.models.Comment import Order
 from trade.models.Commodity import Commodity
 from trade.models.Log import Log
 from trade.models.Parameter import Parameter
 from trade.models.Shop import Shop
-from trade.models.status import ORDER_STATUS_ORDERED, ORDER_STATUS_PAID, ORDER_STATUS_DELIVERED, \
-    ORDER_STATUS_CONFIRMED, ORDER_STATUS_DICT, COMM_STATUS_CLOSED, COMM_STATUS_ON_SELL
+from trade.models.status import ORDER_STATUS_ORDERED, ORDER_STATUS_DICT
+from trade.order_util import place_order, checkout, cancel_order, transit_order, bulk_transit_orders, \
+    get_order_summary, ORDER_PAY_TIMEOUT
 from trade.query_util import query_page, query_order_by, query_filter, filter_order_and_list
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, require_jwt, require_item_exist, require_keys, get_user, data_export
+    filter_data, require_jwt, require_item_fetch, require_keys, get_user, data_export, FieldDict, idempotent
 
-
-def get_comm_para_price(comm: Commodity, para_list: list[int]) -> float:
-    base_price = comm.price - comm.discount
-    for para_id in para_list:
-        base_price += Parameter.objects.get(id=para_id).add
-    return float(base_price)
-
-
-def check_paras(para_list: list[int]) -> bool:
-    for para_id in para_list:
-        if not Parameter.objects.filter(id=para_id).exists():
-            return False
-    return True
+BULK_ORDER_MAX_COUNT = 500
+CHECKOUT_MAX_LINES = 50
 
 
 @response_wrapper
 @require_jwt()
+@idempotent
 @require_POST
-@require_keys({"num", "select_paras"})
-@require_item_exist(Commodity, "id", "query_id")
-def create_order(request: HttpRequest, query_id):
+@require_keys({"num": int, "select_paras": [int]})
+@require_item_fetch(Commodity, "id", "query_id")
+def create_order(request: HttpRequest, comm: Commodity):
     """
     [POST] /api/order/new/<int:query_id>
-    这里使用了函数 create_order
     """
-    user = get_user(request)
-    comm = Commodity.objects.get(id=query_id)
     data = parse_data(request)
-    filter_data(data, {"num", "select_paras", "address", "note"})
-    check_paras(data["select_paras"])
-    data["price"] = get_comm_para_price(comm, data["select_paras"]) * data["num"]
-    select_paras = data["select_paras"]
-    del data["select_paras"]
-    data["user"] = user
-    data["commodity"] = comm
-    # 检查下数据会不会爆 Decimal(8, 2)
-    if data["price"] > 88888888.88:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "非法订单")
-    with connection.cursor() as cursor:
-        cursor.execute("select create_order(%s,%s,%s,%s,%s,%s)",
-                       [user.id, comm.id, data["num"], data["price"],
-                        None if data.get("address", None) is None else data["address"],
-                        None if data.get("note", None) is None else data["note"]])
-        ret = cursor.fetchall()[0][0]
-    if ret == 0:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "很抱歉，该商品被抢光了")
-    order = Order.objects.get(id=ret)
-    for para_id in select_paras:
-        order.select_paras.add(para_id)
-    if comm.sale >= comm.total and comm.status != COMM_STATUS_CLOSED:
-        comm.status = COMM_STATUS_CLOSED
-        comm.save()
+    place = flash_sale_place_order if comm.flash_sale else place_order
+    try:
+        order = place(get_user(request), comm, data["num"], data["select_paras"], data.get("address", None),
+                      data.get("note", None))
+    except OrderException as exception:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
     return success_api_response({"id": order.id})
 
 
+@response_wrapper
+@require_jwt()
+@idempotent
+@require_POST
+@require_keys({"lines": [dict]})
+def checkout_order(request: HttpRequest):
+    """
+    [POST] /api/order/checkout
+    lines example:
+    [{"commodity_id": 1, "num": 2, "select_paras": [1, 3]}, {"commodity_id": 2, "num": 1, "select_paras": []}]
+    所有商品一起下单，任何一个商品库存不足则全部失败
+    """
+    data = parse_data(request)
+    lines = data["lines"]
+    if len(lines) > CHECKOUT_MAX_LINES:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "单次最多结算{}个商品".format(CHECKOUT_MAX_LINES))
+    for line in lines:
+        if not isinstance(line.get("commodity_id"), int) or not isinstance(line.get("num"), int) or \
+                not isinstance(line.get("select_paras"), list) or \
+                not all(isinstance(para_id, int) for para_id in line["select_paras"]):
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "字段lines类型错误")
+    try:
+        orders = checkout(get_user(request), lines, data.get("address", None), data.get("note", None))
+    except OrderException as exception:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
+    return success_api_response({"ids": [order.id for order in orders]})
+
+
 def brief_para_to_dict(para: Parameter) -> dict:
     data = {
         "id": para.id,
@@ -82,13 +80,13 @@ def brief_para_to_dict(para: Parameter) -> dict:
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Order, "id", "query_id")
-def get_order_detail(request: HttpRequest, query_id):
+@require_item_fetch(Order, "id", "query_id", select_related=("user", "commodity__shop", "commodity__image"),
+                    prefetch_related=("select_paras",))
+def get_order_detail(request: HttpRequest, order: Order):
     """
     [GET] /api/order/<int:query_id>
     """
-    order = Order.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "id": order.id,
         "user_id": order.user.id,
         "user__nickname": order.user.nickname,
@@ -106,30 +104,30 @@ def get_order_detail(request: HttpRequest, query_id):
         "deliver_time": order.deliver_time,
         "confirm_time": order.confirm_time,
         "close_time": order.close_time,
-        "image_url": s3_download_url(order.commodity.image.oss_token),
-        "select_paras": list(map(brief_para_to_dict, order.select_paras.all())),
+        "image_url": lambda: public_image_url(order.commodity.image),
+        "select_paras": lambda: list(map(brief_para_to_dict, order.select_paras.all())),
         "note": order.note,
-    }
+    })
     return success_api_response(data)
 
 
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_keys({"address"})
-@require_item_exist(Order, "id", "query_id")
-def update_order_address(request: HttpRequest, query_id):
+@require_keys({"address": str})
+@require_item_fetch(Order, "id", "query_id")
+def update_order_address(request: HttpRequest, order: Order):
     """
     [PUT] /api/order/address/<int:query_id>
     """
     data = parse_data(request)
     user = get_user(request)
-    if user != Order.objects.get(id=query_id).user:
+    if user.id != order.user_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
     filter_data(data, {"address"})
     try:
-        Order.objects.filter(id=query_id).update(**data)
-        Log.objects.create(user=user, detail="修改订单地址ID:{}".format(query_id))
+        Order.objects.filter(id=order.id).update(**data)
+        Log.objects.create(user=user, detail="修改订单地址ID:{}".format(order.id))
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
@@ -138,103 +136,157 @@ def update_order_address(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_item_exist(Order, "id", "query_id")
-def close_order(request: HttpRequest, query_id):
+@require_item_fetch(Order, "id", "query_id")
+def close_order(request: HttpRequest, order: Order):
     """
     [POST] /api/order/close/<int:query_id>
-    这里使用了存储过程 close_order
     """
-    order = Order.objects.get(id=query_id)
-    if get_user(request) != order.user:
+    user = get_user(request)
+    if user.id != order.user_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
-    if order.status != ORDER_STATUS_ORDERED:
+    if not cancel_order(order):
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单关闭失败")
-    with connection.cursor() as cursor:
-        cursor.execute("call close_order(%s);", [query_id, ])
-    if order.commodity.sale < order.commodity.total and order.commodity.status == COMM_STATUS_CLOSED:
-        order.commodity.status = COMM_STATUS_ON_SELL
-        order.commodity.save()
-    Log.objects.create(user=get_user(request), detail="用户关闭订单ID:{}".format(query_id))
+    stock_tokens.release(order.commodity_id, order.num)
+    Log.objects.create(user=user, detail="用户关闭订单ID:{}".format(order.id))
     return success_api_response()
 
 
+def order_transition_failed(query_id: int, user_id: int = None) -> dict:
+    """
+    tell why a conditional order transition changed nothing
+    :param query_id: order id
+    :param user_id: id of the buyer the order must belong to, None if not checked
+    :return: failed api response
+    """
+    order = Order.objects.filter(id=query_id).only("user_id", "status", "start_time").first()
+    if order is None:
+        return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "对象不存在")
+    if user_id is not None and order.user_id != user_id:
+        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
+    if order.status == ORDER_STATUS_ORDERED and order.start_time < timezone.now() - ORDER_PAY_TIMEOUT:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单已超时")
+    return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单状态出出错")
+
+
 @response_wrapper
 @require_jwt()
+@idempotent
 @require_POST
-@require_item_exist(Order, "id", "query_id")
-def pay_order(request: HttpRequest, query_id):
+def pay_order(request: HttpRequest, query_id: int):
     """
     [POST] /api/order/pay/<int:query_id>
     """
-    order = Order.objects.get(id=query_id)
-    if get_user(request) != order.user:
-        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
-    if order.status != ORDER_STATUS_ORDERED:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单状态出出错")
-    order.status = ORDER_STATUS_PAID
-    order.pay_time = timezone.now()
-    order.save()
-    Log.objects.create(user=get_user(request), detail="支付订单ID:{}".format(query_id))
+    user = get_user(request)
+    if not transit_order(query_id, "pay", user_id=user.id, start_time__gte=timezone.now() - ORDER_PAY_TIMEOUT):
+        return order_transition_failed(query_id, user.id)
+    Log.objects.create(user=user, detail="支付订单ID:{}".format(query_id))
     return success_api_response()
 
 
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_item_exist(Order, "id", "query_id")
-def deliver_order(request: HttpRequest, query_id):
+@require_item_fetch(Order, "id", "query_id", select_related=("shop",))
+def deliver_order(request: HttpRequest, order: Order):
     """
     [POST] /api/order/deliver/<int:query_id>
     """
-    order = Order.objects.get(id=query_id)
-    shop = order.commodity.shop
+    shop = order.shop
     user = get_user(request)
-    if user != shop.owner and not shop.admin.contains(user):
+    if user.id != shop.owner_id and not shop.admin.contains(user):
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
-    if order.status != ORDER_STATUS_PAID:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单状态出出错")
-    order.status = ORDER_STATUS_DELIVERED
-    order.deliver_time = timezone.now()
-    order.save()
-    Log.objects.create(user=get_user(request), detail="发货订单ID:{}".format(query_id))
+    if not transit_order(order.id, "deliver", user_id=order.user_id, shop_id=order.shop_id):
+        return order_transition_failed(order.id)
+    Log.objects.create(user=user, detail="发货订单ID:{}".format(order.id))
     return success_api_response()
 
 
 @response_wrapper
 @require_jwt()
 @require_POST
-@require_item_exist(Order, "id", "query_id")
-def confirm_order(request: HttpRequest, query_id):
+def confirm_order(request: HttpRequest, query_id: int):
     """
     [POST] /api/order/confirm/<int:query_id>
     """
-    order = Order.objects.get(id=query_id)
-    if get_user(request) != order.user:
-        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
-    if order.status != ORDER_STATUS_DELIVERED:
-        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "订单状态出出错")
-    order.status = ORDER_STATUS_CONFIRMED
-    order.confirm_time = timezone.now()
-    order.save()
-    Log.objects.create(user=get_user(request), detail="确认收货订单ID:{}".format(query_id))
+    user = get_user(request)
+    if not transit_order(query_id, "confirm", user_id=user.id):
+        return order_transition_failed(query_id, user.id)
+    Log.objects.create(user=user, detail="确认收货订单ID:{}".format(query_id))
     return success_api_response()
 
 
+def bulk_operate_orders(request: HttpRequest, action: str, log_format: str) -> dict:
+    """
+    apply an order transition to several orders of a shop managed by the requesting user
+    :param request: request with shop_id and ids
+    :param action: key of ORDER_TRANSITIONS
+    :param log_format: log detail of each changed order, formatted with order id
+    :return: api response with the result of every order
+    """
+    data = parse_data(request)
+    if len(data["ids"]) > BULK_ORDER_MAX_COUNT:
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "单次最多操作{}个订单".format(BULK_ORDER_MAX_COUNT))
+    shop = Shop.objects.filter(id=data["shop_id"]).first()
+    if shop is None:
+        return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "对象不存在")
+    user = get_user(request)
+    if user.id != shop.owner_id and not shop.admin.contains(user):
+        return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "非法访问！")
+    outcomes, released = bulk_transit_orders(data["ids"], action, shop_id=shop.id)
+    for commodity_id, num in released.items():
+        stock_tokens.release(commodity_id, num)
+    Log.objects.bulk_create([Log(user=user, detail=log_format.format(order_id))
+                             for order_id, changed in outcomes.items() if changed])
+    results = []
+    for order_id in data["ids"]:
+        if order_id not in outcomes:
+            results.append({"id": order_id, "success": False, "error_msg": "订单不存在"})
+        elif not outcomes[order_id]:
+            results.append({"id": order_id, "success": False, "error_msg": "订单状态出错"})
+        else:
+            results.append({"id": order_id, "success": True})
+    return success_api_response({"results": results})
+
+
+@response_wrapper
+@require_jwt()
+@require_POST
+@require_keys({"shop_id": int, "ids": [int]})
+def bulk_deliver_order(request: HttpRequest):
+    """
+    [POST] /api/order/bulk/deliver
+    只处理属于该店铺的已支付订单，返回每个订单的处理结果
+    """
+    return bulk_operate_orders(request, "deliver", "发货订单ID:{}")
+
+
+@response_wrapper
+@require_jwt()
+@require_POST
+@require_keys({"shop_id": int, "ids": [int]})
+def bulk_close_order(request: HttpRequest):
+    """
+    [POST] /api/order/bulk/close
+    只处理属于该店铺的未支付订单，返回每个订单的处理结果
+    """
+    return bulk_operate_orders(request, "close", "店铺关闭订单ID:{}")
+
+
 def admin_order_to_dict(order: Order) -> dict:
-    data = {
+    data = FieldDict({
         "id": order.id,
-        "user_id": order.user.id,
+        "user_id": order.user_id,
         "user__nickname": order.user.nickname,
-        "commodity_id": order.commodity.id,
+        "commodity_id": order.commodity_id,
         "commodity__name": order.commodity.name,
-        "commodity__shop_id": order.commodity.shop.id,
+        "commodity__shop_id": order.commodity.shop_id,
         "commodity__shop__name": order.commodity.shop.name,
-        "image_url": s3_download_url(order.commodity.image.oss_token),
-        "select_paras": list(map(lambda x: x.description, order.select_paras.all())),
+        "image_url": lambda: public_image_url(order.commodity.image, thumbnail=True),
+        "select_paras": lambda: list(map(lambda x: x.description, order.select_paras.all())),
         "price": order.price,
         "status": order.status,
         "start_time": order.start_time,
-    }
+    })
     return data
 
 
@@ -250,7 +302,7 @@ def admin_get_order_list(request: HttpRequest, *args, **kwargs):
     """
     [GET] /api/admin/order/list
     """
-    orders = Order.objects.all()
+    orders = Order.objects.select_related("user", "commodity__shop", "commodity__image")
     try:
         data = filter_order_and_list(orders, admin_order_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -293,20 +345,20 @@ def export_order_list_admin(request: HttpRequest):
 
 
 def user_order_to_dict(order: Order) -> dict:
-    data = {
+    data = FieldDict({
         "id": order.id,
-        "commodity_id": order.commodity.id,
+        "commodity_id": order.commodity_id,
         "commodity__name": order.commodity.name,
         "commodity__price": order.commodity.price - order.commodity.discount,
-        "commodity__shop_id": order.commodity.shop.id,
+        "commodity__shop_id": order.commodity.shop_id,
         "commodity__shop__name": order.commodity.name,
         "num": order.num,
         "price": order.price,
         "status": order.status,
-        "image_url": s3_download_url(order.commodity.image.oss_token),
-        "select_paras": list(map(lambda x: x.description, order.select_paras.all())),
+        "image_url": lambda: public_image_url(order.commodity.image, thumbnail=True),
+        "select_paras": lambda: list(map(lambda x: x.description, order.select_paras.all())),
         "start_time": order.start_time,
-    }
+    })
     return data
 
 
@@ -322,7 +374,7 @@ def user_get_order_list(request: HttpRequest, *args, **kwargs):
     [GET] /api/order/user/list
     """
     user = get_user(request)
-    orders = Order.objects.filter(user=user)
+    orders = Order.objects.select_related("commodity__image").filter(user=user)
     try:
         data = filter_order_and_list(orders, user_order_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -371,11 +423,11 @@ def export_user_order_list(request: HttpRequest):
 
 
 def shop_order_to_dict(order: Order) -> dict:
-    data = {
+    data = FieldDict({
         "id": order.id,
-        "user_id": order.user.id,
+        "user_id": order.user_id,
         "user__nickname": order.user.nickname,
-        "commodity_id": order.commodity.id,
+        "commodity_id": order.commodity_id,
         "commodity__name": order.commodity.name,
         "num": order.num,
         "price": order.price,
@@ -386,17 +438,17 @@ def shop_order_to_dict(order: Order) -> dict:
         "deliver_time": order.deliver_time,
         "confirm_time": order.confirm_time,
         "close_time": order.close_time,
-        "image_url": s3_download_url(order.commodity.image.oss_token),
-        "select_paras": list(map(lambda x: x.description, order.select_paras.all())),
+        "image_url": lambda: public_image_url(order.commodity.image, thumbnail=True),
+        "select_paras": lambda: list(map(lambda x: x.description, order.select_paras.all())),
         "note": order.note,
-    }
+    })
     return data
 
 
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Shop, "id", "query_id")
+@require_item_fetch(Shop, "id", "query_id")
 @query_filter(fields=[("id", int), ("user_id", int), ("user__nickname", str), ("commodity__name", str),
                       ("commodity_id", int), ("num", int), ("price", float), ("address", str), ("status", int),
                       ("start_time", str), ("pay_time", str), ("deliver_time", str), ("confirm_time", str),
@@ -404,15 +456,14 @@ def shop_order_to_dict(order: Order) -> dict:
 @query_order_by(fields=["id", "start_time", "pay_time", "deliver_time", "confirm_time", "close_time", "price",
                         "commodity_id", "num"])
 @query_page(default=10)
-def shop_admin_get_order_list(request: HttpRequest, query_id, *args, **kwargs):
+def shop_admin_get_order_list(request: HttpRequest, shop: Shop, *args, **kwargs):
     """
     [GET] /api/order/shop/list/<int:query_id>
     """
     user = get_user(request)
-    shop = Shop.objects.get(id=query_id)
-    if user != shop.owner and not shop.admin.contains(user):
+    if user.id != shop.owner_id and not shop.admin.contains(user):
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "你没有权限访问这个店铺")
-    orders = Order.objects.filter(commodity__shop=shop)
+    orders = Order.objects.select_related("user", "commodity__image").filter(shop=shop)
     try:
         data = filter_order_and_list(orders, shop_order_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -422,6 +473,32 @@ def shop_admin_get_order_list(request: HttpRequest, query_id, *args, **kwargs):
     return success_api_response(data)
 
 
+@response_wrapper
+@require_jwt()
+@require_GET
+def user_get_order_summary(request: HttpRequest):
+    """
+    [GET] /api/order/user/summary
+    返回当前用户各状态的订单数，键为订单状态
+    """
+    return success_api_response({"counts": get_order_summary("user", get_user(request).id)})
+
+
+@response_wrapper
+@require_jwt()
+@require_GET
+@require_item_fetch(Shop, "id", "query_id")
+def shop_admin_get_order_summary(request: HttpRequest, shop: Shop):
+    """
+    [GET] /api/order/shop/summary/<int:query_id>
+    返回店铺各状态的订单数，键为订单状态
+    """
+    user = get_user(request)
+    if user.id != shop.owner_id and not shop.admin.contains(user):
+        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "你没有权限访问这个店铺")
+    return success_api_response({"counts": get_order_summary("shop", shop.id)})
+
+
 def shop_order_to_dict_export(order: Order) -> dict:
     data = {
         "订单ID": order.id,
@@ -447,15 +524,15 @@ def shop_order_to_dict_export(order: Order) -> dict:
 @response_wrapper
 @require_jwt()
 @require_GET
-def export_shop_order_list(request: HttpRequest, query_id):
+@require_item_fetch(Shop, "id", "query_id")
+def export_shop_order_list(request: HttpRequest, shop: Shop):
     """
     [GET] /api/order/shop/list_csv/<int:query_id>
     """
     user = get_user(request)
-    shop = Shop.objects.get(id=query_id)
-    if user != shop.owner and not shop.admin.contains(user):
+    if user.id != shop.owner_id and not shop.admin.contains(user):
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "你没有权限访问这个店铺")
-    orders = Order.objects.filter(commodity__shop=shop)
+    orders = Order.objects.filter(shop=shop)
     columns = ["订单ID", "用户ID", "用户昵称", "商品ID", "商品名", "所选参数", "订单金额", "商品数量", "订单状态", "创建时间",
                "支付时间", "发货时间", "确认收货时间", "关闭时间", "地址", "备注"]
     filename = "{}的订单信息.csv".format(shop.name)
@@ -1,12 +1,12 @@
 from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
-from trade.file_util import s3_download_url
+from trade.file_util import public_image_url
 from trade.models.Article import Article
 from trade.models.Reply import Reply
 from trade.models.User import ROLE_ADMIN
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, require_jwt, require_item_exist, require_keys, get_user, wrapped_api
+    filter_data, require_jwt, require_item_exist, require_item_fetch, require_keys, get_user, wrapped_api, FieldDict
 
 
 def get_next_floor(article_id: int) -> int:
@@ -19,8 +19,8 @@ def get_next_floor(article_id: int) -> int:
 @require_jwt()
 @require_POST
 @require_keys({"content"})
-@require_item_exist(Article, "id", "query_id")
-def user_new_reply(request: HttpRequest, query_id):
+@require_item_fetch(Article, "id", "query_id")
+def user_new_reply(request: HttpRequest, article: Article):
     """
     [POST] /api/reply/article/<int:query_id>
     """
@@ -28,21 +28,21 @@ def user_new_reply(request: HttpRequest, query_id):
     data = parse_data(request)
     filter_data(data, {"content", "ref_floor"})
     if data.get("ref_floor", None) is not None:
-        temp_qs = Reply.objects.filter(article_id=query_id, floor=data["ref_floor"])
+        temp_qs = Reply.objects.filter(article_id=article.id, floor=data["ref_floor"])
         if not temp_qs.exists():
             return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "引用的楼层不存在")
         refer = temp_qs.first()
         data["refer"] = refer
         del data["ref_floor"]
-    data["floor"] = get_next_floor(query_id)
+    data["floor"] = get_next_floor(article.id)
     data["user"] = user
-    data["article"] = Article.objects.get(id=query_id)
+    data["article"] = article
     reply = Reply.objects.create(**data)
     return success_api_response({"id": reply.id, "floor": reply.floor})
 
 
 def reply_to_dict(reply: Reply) -> dict:
-    data = {
+    data = FieldDict({
         "id": reply.id,
         "user_id": reply.user_id,
         "user__nickname": reply.user.nickname,
@@ -52,23 +52,23 @@ def reply_to_dict(reply: Reply) -> dict:
         "refer": None if reply.refer is None else reply.refer_id,
         "refer_floor": None if reply.refer is None else reply.refer.floor,
         "content": reply.content,
-        "image_url": None if reply.user.image is None else s3_download_url(reply.user.image.oss_token),
-    }
+        "image_url": lambda: None if reply.user.image is None else public_image_url(reply.user.image,
+                                                                                     thumbnail=True),
+    })
     return data
 
 
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
-@require_item_exist(Reply, "id", "query_id")
-def update_reply(request: HttpRequest, query_id):
+@require_item_fetch(Reply, "id", "query_id")
+def update_reply(request: HttpRequest, reply: Reply):
     """
     [PUT] /api/reply/<int:query_id>
     管理员可操作
     """
     user = get_user(request)
-    reply = Reply.objects.get(id=query_id)
-    if user != reply.user and user.role != ROLE_ADMIN:
+    if user.id != reply.user_id and user.role != ROLE_ADMIN:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "非法访问！")
     data = parse_data(request)
     filter_data(data, {"ref_floor", "content"})
@@ -80,7 +80,7 @@ def update_reply(request: HttpRequest, query_id):
         data["refer"] = refer
         del data["ref_floor"]
     try:
-        Reply.objects.filter(id=query_id).update(**data)
+        Reply.objects.filter(id=reply.id).update(**data)
         return success_api_response()
     except Exception as exception:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
@@ -94,23 +94,23 @@ def get_article_all_reply(request: HttpRequest, query_id):
     """
     [GET] /api/reply/article/<int:query_id>
     """
-    return success_api_response({"replies": list(map(reply_to_dict, Reply.objects.filter(article_id=query_id)))})
+    replies = Reply.objects.select_related("user__image", "article", "refer").filter(article_id=query_id)
+    return success_api_response({"replies": list(map(reply_to_dict, replies))})
 
 
 @response_wrapper
 @require_jwt()
 @require_http_methods(["DELETE"])
-@require_item_exist(Reply, "id", "query_id")
-def delete_reply(request: HttpRequest, query_id):
+@require_item_fetch(Reply, "id", "query_id")
+def delete_reply(request: HttpRequest, reply: Reply):
     """
     [DELETE] /api/article/<int:query_id>
     管理员可操作性
     """
     user = get_user(request)
-    reply = Reply.objects.get(id=query_id)
-    if user != reply.user and user.role != ROLE_ADMIN:
+    if user.id != reply.user_id and user.role != ROLE_ADMIN:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "非法访问！")
-    Reply.objects.filter(id=query_id).delete()
+    reply.delete()
     return success_api_response()
 
 
@@ -4,14 +4,15 @@ from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
 from trade.exceptions import InvalidOrderByException, InvalidFilterException
-from trade.file_util import s3_download_url
+from trade.file_util import public_image_url
 from trade.models.Log import Log
 from trade.models.Comment import Comment
 from trade.models.Shop import TYPE_PERSONAL, Shop
 from trade.models.User import User
 from trade.query_util import query_filter, query_order_by, query_page, filter_order_and_list
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, wrapped_api, require_jwt, require_item_exist, require_keys, get_user
+    filter_data, wrapped_api, require_jwt, require_item_exist, require_item_fetch, require_keys, get_user, \
+    FieldDict
 
 
 @response_wrapper
@@ -37,14 +38,13 @@ def register_shop(request: HttpRequest):
 @require_jwt()
 @require_POST
 @require_keys({"student_id"})
-@require_item_exist(Shop, "id", "query_id")
-def add_shop_admin(request: HttpRequest, query_id):
+@require_item_fetch(Shop, "id", "query_id")
+def add_shop_admin(request: HttpRequest, shop: Shop):
     """
     [POST] /api/shop/shop_admin/<int:query_id>
     """
     user = get_user(request)
-    shop = Shop.objects.get(id=query_id)
-    if shop.owner.id != user.id:
+    if shop.owner_id != user.id:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "你不是店主，没有权限操作")
     if shop.type == TYPE_PERSONAL:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "个人店铺不能增加管理员")
@@ -63,14 +63,13 @@ def add_shop_admin(request: HttpRequest, query_id):
 @require_jwt()
 @require_http_methods(["DELETE"])
 @require_keys({"student_id"})
-@require_item_exist(Shop, "id", "query_id")
-def delete_shop_admin(request: HttpRequest, query_id):
+@require_item_fetch(Shop, "id", "query_id")
+def delete_shop_admin(request: HttpRequest, shop: Shop):
     """
     [DELETE] /api/shop/shop_admin/<int:query_id>
     """
     user = get_user(request)
-    shop = Shop.objects.get(id=query_id)
-    if shop.owner.id != user.id:
+    if shop.owner_id != user.id:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "你不是店主，没有权限操作")
     if shop.type == TYPE_PERSONAL:
         return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "个人店铺不能删除管理员")
@@ -100,24 +99,24 @@ def user_info_to_dict(user: User) -> dict:
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(Shop, "id", "query_id")
-def get_shop_detail(request: HttpRequest, query_id):
+@require_item_fetch(Shop, "id", "query_id", select_related=("owner__student", "image"),
+                    prefetch_related=("admin__student",))
+def get_shop_detail(request: HttpRequest, shop: Shop):
     """
     [GET] /api/shop/<int:query_id>
     """
-    shop = Shop.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "id": shop.id,
         "name": shop.name,
         "reg_time": shop.reg_time,
         "introduction": shop.introduction,
-        "grade": get_shop_avg_grade(query_id),
+        "grade": lambda: get_shop_avg_grade(shop.id),
         "type": shop.type,
         "owner": user_info_to_dict(shop.owner),
-        "img_url": None if shop.image is None else s3_download_url(shop.image.oss_token),
-    }
+        "img_url": lambda: None if shop.image is None else public_image_url(shop.image),
+    })
     if shop.type != TYPE_PERSONAL:
-        data["admins"] = list(map(user_info_to_dict, shop.admin.all()))
+        data["admins"] = lambda: list(map(user_info_to_dict, shop.admin.all()))
     return success_api_response(data)
 
 
@@ -125,19 +124,18 @@ def get_shop_detail(request: HttpRequest, query_id):
 @require_jwt(need_valid=True)
 @require_http_methods(["PUT"])
 @require_keys({"introduction"})
-@require_item_exist(Shop, "id", "query_id")
-def update_shop_detail(request: HttpRequest, query_id):
+@require_item_fetch(Shop, "id", "query_id")
+def update_shop_detail(request: HttpRequest, shop: Shop):
     """
     [PUT] /api/shop/<int:query_id>
     """
-    shop = Shop.objects.get(id=query_id)
     data = parse_data(request)
     filter_data(data, {"introduction"})
     user = get_user(request)
-    if not shop.admin.contains(user) and user.id != shop.owner.id:
+    if not shop.admin.contains(user) and user.id != shop.owner_id:
         return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "你没有权限操作这个店铺")
     try:
-        User.objects.filter(id=query_id).update(**data)
+        Shop.objects.filter(id=shop.id).update(**data)
         Log.objects.create(user=user, detail="更新店铺信息ID:{}".format(shop.id))
         return success_api_response()
     except Exception as exception:
@@ -145,13 +143,13 @@ def update_shop_detail(request: HttpRequest, query_id):
 
 
 def shop_to_dict(shop: Shop) -> dict:
-    data = {
+    data = FieldDict({
         "id": shop.id,
         "name": shop.name,
         "reg_time": shop.reg_time,
         "type": shop.type,
-        "owner": user_info_to_dict(shop.owner),
-    }
+        "owner": lambda: user_info_to_dict(shop.owner),
+    })
     return data
 
 
@@ -166,7 +164,7 @@ def list_shop(request: HttpRequest, *args, **kwargs):
     """
     [GET] /api/admin/shop/list
     """
-    shops = Shop.objects.all()
+    shops = Shop.objects.select_related("owner__student")
     try:
         data = filter_order_and_list(shops, shop_to_dict, **kwargs)
     except InvalidOrderByException:
@@ -179,12 +177,11 @@ def list_shop(request: HttpRequest, *args, **kwargs):
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(User, "id", "query_id")
-def list_user_shop(request: HttpRequest, query_id):
+@require_item_fetch(User, "id", "query_id")
+def list_user_shop(request: HttpRequest, user: User):
     """
     [GET] /api/shop/user_shop/<int:query_id>
     """
-    user = User.objects.get(id=query_id)
     owner_shops = list(map(shop_to_dict, user.owner_shop.all()))
     admin_shops = list(map(shop_to_dict, user.admins_shop.all()))
     data = {
@@ -195,7 +192,7 @@ def list_user_shop(request: HttpRequest, query_id):
 
 
 def get_shop_avg_grade(shop_id: int):
-    comments = Comment.objects.filter(order__commodity__shop_id=shop_id)
+    comments = Comment.objects.filter(order__shop_id=shop_id)
     if not comments.exists():
         return None
     return comments.aggregate(Avg("grade"))["grade__avg"]
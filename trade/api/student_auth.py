@@ -12,7 +12,7 @@ from trade.models.File import File
 from trade.models.User import User, ROLE_ADMIN
 from trade.query_util import query_filter, query_order_by, query_page, filter_order_and_list
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, require_jwt, require_item_exist, require_keys, wrapped_api, get_user
+    filter_data, require_jwt, require_item_fetch, require_keys, wrapped_api, get_user, FieldDict
 
 
 @response_wrapper
@@ -67,13 +67,12 @@ def get_student_auth_reqs(request: HttpRequest):
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(StuAuthReq, "id", "query_id")
-def get_student_auth_req_detail(request: HttpRequest, query_id):
+@require_item_fetch(StuAuthReq, "id", "query_id", select_related=("user", "admin", "image"))
+def get_student_auth_req_detail(request: HttpRequest, req: StuAuthReq):
     """
     [GET] /api/student/auth_req/detail/<int:query_id>
     """
-    req = StuAuthReq.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "user_id": req.user.id,
         "user__nickname": req.user.nickname,
         "student_id": req.student_id,
@@ -87,8 +86,8 @@ def get_student_auth_req_detail(request: HttpRequest, query_id):
         "comment": req.comment,
         "deal_time": req.deal_time,
         "status": req.status,
-        "image_url": s3_download_url(req.image.oss_token),
-    }
+        "image_url": lambda: s3_download_url(req.image.oss_token),
+    })
     return success_api_response(data)
 
 
@@ -130,13 +129,12 @@ def get_admin_student_auth_reqs(request: HttpRequest, *args, **kwargs):
 @response_wrapper
 @require_jwt(admin=True)
 @require_GET
-@require_item_exist(StuAuthReq, "id", "query_id")
-def admin_get_student_auth_req_detail(request: HttpRequest, query_id):
+@require_item_fetch(StuAuthReq, "id", "query_id", select_related=("user", "image"))
+def admin_get_student_auth_req_detail(request: HttpRequest, req: StuAuthReq):
     """
     [GET] /api/admin/student/auth_req/detail/<int:query_id>
     """
-    req = StuAuthReq.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "id": req.id,
         "user_id": req.user.id,
         "user__nickname": req.user.nickname,
@@ -147,8 +145,8 @@ def admin_get_student_auth_req_detail(request: HttpRequest, query_id):
         "depart": req.depart,
         "attendance_year": req.attendance_year,
         "gender": req.gender,
-        "image_url": s3_download_url(req.image.oss_token),
-    }
+        "image_url": lambda: s3_download_url(req.image.oss_token),
+    })
     return success_api_response(data)
 
 
@@ -165,13 +163,12 @@ def check_student_id_exist(request: HttpRequest, query_id):
 @response_wrapper
 @require_jwt(admin=True)
 @require_http_methods(["PUT"])
-@require_item_exist(StuAuthReq, "id", "query_id")
+@require_item_fetch(StuAuthReq, "id", "query_id", select_related=("user",))
 @require_keys({"pass", "comment"})
-def admin_update_student_auth_req_status(request: HttpRequest, query_id):
+def admin_update_student_auth_req_status(request: HttpRequest, req: StuAuthReq):
     """
     [PUT] /api/admin/student/auth_req/detail/<int:query_id>
     """
-    req = StuAuthReq.objects.get(id=query_id)
     data = parse_data(request)
     req.deal_time = timezone.now()
     req.comment = data["comment"]
@@ -182,11 +179,11 @@ def admin_update_student_auth_req_status(request: HttpRequest, query_id):
                                          attendance_year=req.attendance_year, gender=req.gender)
         req.user.student = student
         req.user.save()
-        Log.objects.create(user=get_user(request), detail="通过学生认证请求ID:{}".format(query_id))
+        Log.objects.create(user=get_user(request), detail="通过学生认证请求ID:{}".format(req.id))
     else:
         req.status = AUTH_REQ_STATUS_DENIED
         req.save()
-        Log.objects.create(user=get_user(request), detail="拒绝学生认证请求ID:{}".format(query_id))
+        Log.objects.create(user=get_user(request), detail="拒绝学生认证请求ID:{}".format(req.id))
     return success_api_response()
 
 
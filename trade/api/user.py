@@ -1,25 +1,26 @@
+from functools import cache
+
 from django.http import HttpRequest
 from django.views.decorators.http import require_GET, require_http_methods
 
 from trade.exceptions import InvalidOrderByException, InvalidFilterException
-from trade.file_util import s3_download_url
+from trade.file_util import public_image_url, public_image_urls
 from trade.models.Log import Log
 from trade.models.User import User, ROLE_ADMIN, ROLE_NORMAL_USER
-from trade.query_util import query_filter, query_order_by, query_page, filter_order_and_list
+from trade.query_util import query_filter, query_order_by, query_page, filter_order_and_list, query_ids
 from trade.util import response_wrapper, success_api_response, failed_api_response, parse_data, ErrorCode, \
-    filter_data, wrapped_api, require_jwt, require_item_exist, data_export, get_user
+    filter_data, wrapped_api, require_jwt, require_item_exist, require_item_fetch, data_export, get_user, FieldDict
 
 
 @response_wrapper
 @require_jwt()
 @require_GET
-@require_item_exist(User, "id", "query_id")
-def get_user_detail(request: HttpRequest, query_id):
+@require_item_fetch(User, "id", "query_id", select_related=("student", "image"))
+def get_user_detail(request: HttpRequest, user: User):
     """
     [GET] /api/user/<int:query_id>
     """
-    user = User.objects.get(id=query_id)
-    data = {
+    data = FieldDict({
         "id": user.id,
         "username": user.username,
         "nickname": user.nickname,
@@ -28,13 +29,43 @@ def get_user_detail(request: HttpRequest, query_id):
         "email": user.email,
         "signature": user.signature,
         "is_admin": user.role == ROLE_ADMIN,
-        "student_id": None if user.student is None else user.student.id,
+        "student_id": user.student_id,
         "student__name": None if user.student is None else user.student.name,
-        "img_url": None if user.image is None else s3_download_url(user.image.oss_token),
-    }
+        "img_url": lambda: None if user.image is None else public_image_url(user.image),
+    })
     return success_api_response(data)
 
 
+@response_wrapper
+@require_jwt()
+@require_GET
+@query_ids(max_count=50)
+def multi_get_user(request: HttpRequest, *args, **kwargs):
+    """
+    [GET] /api/user/multi?ids=1,2,3
+    返回以用户id为键的字典，不存在的id不包含在结果中
+    """
+    users = list(User.objects.select_related("student", "image").filter(id__in=kwargs.get("ids")))
+    urls = cache(lambda: public_image_urls((user.image for user in users if user.image is not None), thumbnail=True))
+
+    def multi_user_to_dict(user: User) -> dict:
+        return FieldDict({
+            "id": user.id,
+            "username": user.username,
+            "nickname": user.nickname,
+            "reg_time": user.reg_time,
+            "phone_no": user.phone_no,
+            "email": user.email,
+            "signature": user.signature,
+            "is_admin": user.role == ROLE_ADMIN,
+            "student_id": user.student_id,
+            "student__name": None if user.student is None else user.student.name,
+            "img_url": lambda: None if user.image is None else urls()[user.image_id],
+        })
+
+    return success_api_response({user.id: multi_user_to_dict(user) for user in users})
+
+
 @response_wrapper
 @require_jwt()
 @require_http_methods(["PUT"])
@@ -56,7 +87,7 @@ def update_user_detail(request: HttpRequest, query_id):
 
 
 def user_to_dict(user: User) -> dict:
-    data = {
+    data = FieldDict({
         "id": user.id,
         "username": user.username,
         "nickname": user.nickname,
@@ -64,9 +95,9 @@ def user_to_dict(user: User) -> dict:
         "phone_no": user.phone_no,
         "email": user.email,
         "role": user.role,
-        "student_id": None if user.student is None else user.student.id,
+        "student_id": user.student_id,
         "valid": user.valid
-    }
+    })
     return data
 
 
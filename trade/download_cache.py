@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from DBProject.settings import DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_SIZE
+
+# 单个文件超过缓存总大小的 1/8 时不缓存，避免一个大文件挤掉所有热点文件
+MAX_ENTRY_RATIO = 8
+
+
+class DownloadCache:
+    """
+    bounded read-through cache of objects on local disk, keyed by oss_token.
+    objects are never overwritten because oss_token contains upload time, so entries never go stale.
+    the modify time of an entry is refreshed on every hit and the least recently used entries are evicted when the
+    total size exceeds max_size, the directory can be shared by several processes
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        # 目录在第一次写入时才创建，目录不可写时只是不缓存，不影响启动和下载
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, oss_token: str) -> str:
+        return os.path.join(self._directory, hashlib.sha256(oss_token.encode("utf-8")).hexdigest())
+
+    def _scan(self) -> tuple[list, int]:
+        """
+        :return: entries sorted by modify time as (modify time, size, path), total size
+        """
+        entries = []
+        with os.scandir(self._directory) as iterator:
+            for entry in iterator:
+                if entry.name.startswith(".") or entry.name.endswith(".meta"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries, sum(entry[1] for entry in entries)
+
+    def _evict(self) -> None:
+        # 其他进程也会写入同一目录，淘汰前重新统计实际大小
+        entries, self._size = self._scan()
+        for _, size, path in entries:
+            if self._size <= self._max_size:
+                break
+            for file in (path, path + ".meta"):
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+            self._size -= size
+
+    def open(self, oss_token: str):
+        """
+        open cached object
+        :param oss_token: oss_token of file
+        :return: (opened file, metadata dict), None if not cached
+        """
+        path = self._path(oss_token)
+        try:
+            # 文件交给调用者，由返回的响应关闭
+            file = open(path, "rb")  # pylint:disable=R1732
+        except FileNotFoundError:
+            return None
+        try:
+            with open(path + ".meta", "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            # 正在被淘汰
+            file.close()
+            return None
+        return file, meta
+
+    def fill(self, oss_token: str, chunks, size: int, meta: dict):
+        """
+        relay chunks and write them to cache at the same time, the entry is added only if all size bytes are relayed
+        :param oss_token: oss_token of file
+        :param chunks: iterator of object content
+        :param size: size of object
+        :param meta: metadata returned by open on hit, e.g. etag
+        :return: iterator of object content
+        """
+        if size > self._max_size // MAX_ENTRY_RATIO:
+            yield from chunks
+            return
+        path = self._path(oss_token)
+        temp_path = os.path.join(self._directory, ".{}.tmp".format(uuid.uuid4().hex))
+        written = 0
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            # 写入失败时要提前关闭并继续转发，不能使用 with
+            file = open(temp_path, "wb")  # pylint:disable=R1732
+        except OSError:
+            file = None
+        try:
+            for chunk in chunks:
+                if file is not None:
+                    try:
+                        file.write(chunk)
+                        written += len(chunk)
+                    except OSError:
+                        # 磁盘写满等错误不影响下载，放弃缓存
+                        file.close()
+                        file = None
+                yield chunk
+            if file is not None and written == size:
+                file.close()
+                self._add(path, temp_path, size, meta)
+        finally:
+            if file is not None:
+                file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def _add(self, path: str, temp_path: str, size: int, meta: dict) -> None:
+        try:
+            with open(path + ".meta", "w", encoding="utf-8") as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(temp_path, path)
+            with self._lock:
+                if self._size is None:
+                    self._size = self._scan()[1]
+                else:
+                    self._size += size
+                if self._size > self._max_size:
+                    self._evict()
+        except OSError:
+            pass
+
+
+download_cache = DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_SIZE) if DOWNLOAD_CACHE_DIR else None
@@ -14,3 +14,36 @@ class InvalidOrderByException(Exception):
 
     def __str__(self):
         return self.msg
+
+
+class OrderException(Exception):
+    def __init__(self, msg="订单操作失败"):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class InvalidOrderException(OrderException):
+    def __init__(self):
+        OrderException.__init__(self, "非法订单")
+
+
+class InvalidParameterException(OrderException):
+    def __init__(self):
+        OrderException.__init__(self, "选择的参数不合法")
+
+
+class SoldOutException(OrderException):
+    def __init__(self):
+        OrderException.__init__(self, "很抱歉，该商品被抢光了")
+
+
+class InvalidRangeException(Exception):
+    def __init__(self):
+        Exception.__init__(self)
+        self.msg = "请求的范围超出文件大小"
+
+    def __str__(self):
+        return self.msg
@@ -1,17 +1,19 @@
+import hashlib
+import os
+import re
 from datetime import timedelta, datetime
+from io import BytesIO
 
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse, FileResponse
 from django.utils.encoding import escape_uri_path
-from minio import Minio
 
-from DBProject.settings import S3_SSL, S3_SECRET_ID, S3_SECRET_KEY, S3_ADDRESS, S3_BUCKET_NAME
+from DBProject.settings import PUBLIC_IMAGES, PUBLIC_IMAGE_URL
+from trade.download_cache import download_cache
+from trade.exceptions import InvalidRangeException
+from trade.storage import get_storage
 
-minio_client = Minio(
-    S3_ADDRESS,
-    access_key=S3_SECRET_ID,
-    secret_key=S3_SECRET_KEY,
-    secure=S3_SSL
-)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
 
 
 def _validate_upload_file(request: HttpRequest) -> bool:
@@ -25,38 +27,312 @@ def _validate_upload_file(request: HttpRequest) -> bool:
     return True
 
 
-def s3_download(oss_token: str, filename: str) -> HttpResponse:
+# pylint:disable=R0911
+def _parse_range(range_header: str, get_size):
     """
-    download file from object storage
-    :param oss_token: oss_token of file
-    :param filename: filename for set response
-    :return: response
+    map a single http byte range to (offset, length) of get_object, length 0 means to the end of object
+    :param range_header: value of Range header
+    :param get_size: function returns size of object, only called for suffix range
+    :return: (offset, length), None if the header is absent or can not be parsed (whole object is returned),
+    False if the range can not be satisfied
     """
-    response = minio_client.get_object(S3_BUCKET_NAME, oss_token)
-    response = HttpResponse(response.read())
+    if range_header is None:
+        return None
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.group(1), match.group(2)
+    if start == "":
+        suffix = int(end)
+        size = get_size()
+        if suffix == 0 or size == 0:
+            return False
+        return max(size - suffix, 0), min(suffix, size)
+    if end == "":
+        return int(start), 0
+    if int(end) < int(start):
+        return None
+    return int(start), int(end) - int(start) + 1
+
+
+def _range_not_satisfiable(size: int) -> HttpResponse:
+    response = HttpResponse(status=416)
+    response["Content-Range"] = "bytes */{}".format(size)
+    return response
+
+
+def _set_download_headers(response: HttpResponse, filename: str) -> HttpResponse:
     response["Content-Type"] = "application/octet-stream"
     response["Content-Disposition"] = "attachment;filename*=utf-8''{}".format(escape_uri_path(filename))
+    response["Accept-Ranges"] = "bytes"
     return response
 
 
+def _stream_file(file, length: int):
+    try:
+        while length > 0:
+            chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _cached_download(file, meta: dict, filename: str, range_header: str) -> HttpResponse:
+    """
+    serve a cached object from local disk, whole file is sent by FileResponse which uses sendfile if the server
+    supports wsgi.file_wrapper
+    """
+    size = os.fstat(file.fileno()).st_size
+    byte_range = _parse_range(range_header, lambda: size)
+    if byte_range is None:
+        download = FileResponse(file)
+    else:
+        offset, length = (0, 0) if byte_range is False else byte_range
+        if byte_range is False or offset >= size:
+            file.close()
+            return _range_not_satisfiable(size)
+        length = size - offset if length == 0 else min(length, size - offset)
+        file.seek(offset)
+        download = StreamingHttpResponse(_stream_file(file, length), status=206)
+        download["Content-Length"] = length
+        download["Content-Range"] = "bytes {}-{}/{}".format(offset, offset + length - 1, size)
+    for header, value in meta.items():
+        download[header] = value
+    return _set_download_headers(download, filename)
+
+
+def s3_download(oss_token: str, filename: str, range_header: str = None) -> HttpResponse:
+    """
+    download file from object storage, the object is relayed chunk by chunk instead of being read into memory.
+    if local download cache is enabled, cached objects are served from local disk and whole-object downloads
+    fill the cache while they are relayed
+    :param oss_token: oss_token of file
+    :param filename: filename for set response
+    :param range_header: Range header of request, optional, a single byte range is supported
+    :return: response
+    """
+    if download_cache is not None:
+        cached = download_cache.open(oss_token)
+        if cached is not None:
+            return _cached_download(cached[0], cached[1], filename, range_header)
+    storage = get_storage()
+    byte_range = _parse_range(range_header, lambda: storage.stat(oss_token).size)
+    if byte_range is False:
+        return _range_not_satisfiable(storage.stat(oss_token).size)
+    offset, length = (0, 0) if byte_range is None else byte_range
+    try:
+        stream, headers = storage.get_object(oss_token, offset, length)
+    except InvalidRangeException:
+        return _range_not_satisfiable(storage.stat(oss_token).size)
+    meta = {header: headers.get(header) for header in ("ETag", "Last-Modified") if headers.get(header) is not None}
+    if download_cache is not None and byte_range is None and headers.get("Content-Length") is not None:
+        stream = download_cache.fill(oss_token, stream, int(headers.get("Content-Length")), meta)
+    download = StreamingHttpResponse(stream, status=206 if byte_range is not None else 200)
+    for header in ("Content-Length", "ETag", "Last-Modified", "Content-Range"):
+        if headers.get(header) is not None:
+            download[header] = headers.get(header)
+    return _set_download_headers(download, filename)
+
+
 def s3_download_url(oss_token: str) -> str:
     """
     get download url for front-end, expire time: 1h
     :param oss_token: oss_token of file
     :return: download_url
     """
-    return minio_client.presigned_get_object(S3_BUCKET_NAME, oss_token, expires=timedelta(hours=1))
+    return get_storage().download_url(oss_token, timedelta(hours=1))
 
 
-def s3_upload(oss_token: str, request: HttpRequest) -> HttpResponse:
+def s3_download_urls(oss_tokens) -> dict[str, str]:
+    """
+    get download urls of several files, expire time: 1h
+    all urls are signed with the same request date and each oss_token is signed only once
+    :param oss_tokens: iterable of oss_token
+    :return: dict maps oss_token to download_url
+    """
+    storage = get_storage()
+    request_date = datetime.utcnow()
+    return {
+        oss_token: storage.download_url(oss_token, timedelta(hours=1), request_date)
+        for oss_token in set(oss_tokens)
+    }
+
+
+def s3_upload(oss_token: str, request: HttpRequest) -> None:
     """
     upload file to object storage
     :param oss_token: oss_token of file
     :param request: upload file request
-    :return: response
     """
-    response = minio_client.put_object(S3_BUCKET_NAME, oss_token, request.FILES["file"], request.FILES["file"].size)
-    return response
+    get_storage().put_object(oss_token, request.FILES["file"], request.FILES["file"].size)
+
+
+def s3_get_bytes(oss_token: str) -> bytes:
+    """
+    read the whole object into memory, only for small files such as images
+    :param oss_token: oss_token of file
+    :return: content of object
+    """
+    return get_storage().read(oss_token)
+
+
+def s3_put_bytes(oss_token: str, data: bytes, content_type: str) -> None:
+    """
+    put bytes to object storage
+    :param oss_token: oss_token of file
+    :param data: content
+    :param content_type: content type of object
+    """
+    get_storage().put_object(oss_token, BytesIO(data), len(data), content_type)
+
+
+def get_thumbnail_token(oss_token: str) -> str:
+    """
+    oss token of the thumbnail, which is stored next to the original file
+    :param oss_token: oss_token of original file
+    :return: oss_token of thumbnail
+    """
+    return "{}@thumb.webp".format(oss_token)
+
+
+def thumbnail_oss_token(file) -> str:
+    """
+    oss token for list pages, the thumbnail if it has been generated else the original file
+    :param file: File
+    :return: oss_token
+    """
+    return get_thumbnail_token(file.oss_token) if file.has_thumbnail else file.oss_token
+
+
+def _is_public_image(file) -> bool:
+    # 只有文件头确认是图片的文件才使用公开 url，其他文件即使被设置为头像也只能通过预签名 url 下载
+    return PUBLIC_IMAGES and file.content_hash is not None and file.image_type is not None
+
+
+def public_image_url(file, thumbnail: bool = False) -> str:
+    """
+    url of commodity, shop and user images, which is a long-lived url keyed by content hash if public images are
+    enabled, otherwise a presigned url
+    :param file: File
+    :param thumbnail: use thumbnail if it has been generated
+    :return: url
+    """
+    if not _is_public_image(file):
+        return s3_download_url(thumbnail_oss_token(file) if thumbnail else file.oss_token)
+    if thumbnail and file.has_thumbnail:
+        return "{}{}/thumb".format(PUBLIC_IMAGE_URL, file.content_hash)
+    return "{}{}".format(PUBLIC_IMAGE_URL, file.content_hash)
+
+
+def public_image_urls(files, thumbnail: bool = False) -> dict[int, str]:
+    """
+    get urls of several images, presigned urls are signed together
+    :param files: iterable of File
+    :param thumbnail: use thumbnail if it has been generated
+    :return: dict maps file id to url
+    """
+    files = list(files)
+    oss_tokens = {file.id: thumbnail_oss_token(file) if thumbnail else file.oss_token for file in files}
+    presigned = s3_download_urls(oss_tokens[file.id] for file in files if not _is_public_image(file))
+    return {file.id: public_image_url(file, thumbnail) if _is_public_image(file) else presigned[oss_tokens[file.id]]
+            for file in files}
+
+
+def s3_remove(oss_token: str) -> None:
+    """
+    remove object from object storage
+    :param oss_token: oss_token of file
+    """
+    get_storage().remove_object(oss_token)
+
+
+# 允许通过公开 url 内联展示的图片类型及其文件头，不包括可以内嵌脚本的 svg
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+IMAGE_HEAD_SIZE = 12
+
+
+def sniff_image_type(head: bytes):
+    """
+    detect image type by the leading bytes of file instead of the filename given by uploader
+    :param head: at least the first IMAGE_HEAD_SIZE bytes of file
+    :return: one of image/jpeg, image/png, image/gif and image/webp, None for any other file
+    """
+    for signature, image_type in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def file_image_type(file):
+    """
+    detect image type of uploaded file by its leading bytes, the file is rewound afterwards
+    :param file: UploadedFile
+    :return: see sniff_image_type
+    """
+    file.seek(0)
+    head = file.read(IMAGE_HEAD_SIZE)
+    file.seek(0)
+    return sniff_image_type(head)
+
+
+def file_sha256(file) -> str:
+    """
+    calculate sha256 of uploaded file chunk by chunk, the file is rewound afterwards
+    :param file: UploadedFile
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def s3_sha256_image_type(oss_token: str) -> tuple[str, str]:
+    """
+    calculate sha256 and detect image type of an object by streaming it once, for files put to object storage directly
+    :param oss_token: oss_token of file
+    :return: hex digest, image type (see sniff_image_type)
+    """
+    sha256 = hashlib.sha256()
+    head = b""
+    chunks = get_storage().get_object(oss_token)[0]
+    try:
+        for chunk in chunks:
+            if len(head) < IMAGE_HEAD_SIZE:
+                head += chunk[:IMAGE_HEAD_SIZE - len(head)]
+            sha256.update(chunk)
+    finally:
+        chunks.close()
+    return sha256.hexdigest(), sniff_image_type(head)
+
+
+def s3_upload_url(oss_token: str) -> str:
+    """
+    get presigned upload url for front-end, the file is put to object storage directly, expire time: 1h
+    :param oss_token: oss_token of file
+    :return: upload_url
+    """
+    return get_storage().upload_url(oss_token, timedelta(hours=1))
+
+
+def s3_stat(oss_token: str):
+    """
+    get metadata of object
+    :param oss_token: oss_token of file
+    :return: ObjectStat with size, etag, last_modified, None if object does not exist
+    """
+    return get_storage().stat(oss_token)
 
 
 def get_oss_token(query_id: int, filename: str) -> str:
@@ -0,0 +1,165 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from DBProject.settings import FLASH_SALE_WORKERS, FLASH_SALE_QUEUE_SIZE, FLASH_SALE_RESEED_SECONDS
+from trade.exceptions import OrderException, InvalidOrderException, SoldOutException
+from trade.models.Commodity import Commodity
+from trade.models.Order import Order
+from trade.models.User import User
+from trade.models.status import COMM_STATUS_PRE_SELL
+from trade.order_util import place_order, get_stock
+
+
+class StockTokens:
+    """
+    in-memory stock counter of flash sale commodities, seeded from total - sale and resynced with database
+    periodically, so that sold-out requests are rejected without touching database.
+    admitted orders which are not committed yet are counted as in flight and subtracted from the stock read on
+    reseed. the counter is per process and approximate, the conditional update in place_order is the final guard
+    """
+
+    def __init__(self, reseed_seconds: float):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._seed_time = {}
+        self._in_flight = {}
+        self._reseeding = set()
+        self._reseed_seconds = reseed_seconds
+
+    def _need_seed(self, commodity_id: int) -> bool:
+        """
+        decide whether current thread reads stock from database, only one thread reseeds an existing counter and
+        the others keep using it, must be called with lock held
+        """
+        seed_time = self._seed_time.get(commodity_id)
+        if seed_time is None:
+            return True
+        if time.monotonic() - seed_time <= self._reseed_seconds or commodity_id in self._reseeding:
+            return False
+        self._reseeding.add(commodity_id)
+        return True
+
+    def _seed(self, commodity_id: int) -> None:
+        # 查询数据库时不持有锁，其他商品和其他线程不需要等待
+        try:
+            stock = get_stock(commodity_id)
+        except Exception:
+            with self._lock:
+                self._reseeding.discard(commodity_id)
+            raise
+        with self._lock:
+            self._reseeding.discard(commodity_id)
+            self._tokens[commodity_id] = stock - self._in_flight.get(commodity_id, 0)
+            self._seed_time[commodity_id] = time.monotonic()
+
+    def acquire(self, commodity_id: int, num: int) -> bool:
+        """
+        take num tokens of commodity, the order is in flight until complete or cancel is called
+        :return: True if there are enough tokens else False
+        """
+        with self._lock:
+            need_seed = self._need_seed(commodity_id)
+        if need_seed:
+            self._seed(commodity_id)
+        with self._lock:
+            if self._tokens.get(commodity_id, 0) < num:
+                return False
+            self._tokens[commodity_id] -= num
+            self._in_flight[commodity_id] = self._in_flight.get(commodity_id, 0) + num
+            return True
+
+    def complete(self, commodity_id: int, num: int) -> None:
+        """
+        the order admitted by acquire is committed, its tokens are now counted by sale in database
+        """
+        with self._lock:
+            self._in_flight[commodity_id] -= num
+
+    def cancel(self, commodity_id: int, num: int) -> None:
+        """
+        the order admitted by acquire failed, give back its tokens
+        """
+        with self._lock:
+            self._in_flight[commodity_id] -= num
+            if commodity_id in self._tokens:
+                self._tokens[commodity_id] += num
+
+    def release(self, commodity_id: int, num: int) -> None:
+        """
+        give back num tokens of a committed order, e.g. order closed
+        """
+        with self._lock:
+            if commodity_id in self._tokens:
+                self._tokens[commodity_id] += num
+
+    def invalidate(self, commodity_id: int) -> None:
+        """
+        drop the counter of commodity, it will be seeded again from database on next acquire
+        """
+        with self._lock:
+            self._tokens.pop(commodity_id, None)
+            self._seed_time.pop(commodity_id, None)
+
+
+class AdmissionQueue:  # pylint:disable=R0903
+    """
+    bounded FIFO queue, orders admitted by StockTokens are written to database by a fixed number of workers
+    """
+
+    def __init__(self, workers: int, max_size: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="flash_sale")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_size = max_size
+
+    def _run(self, func, *args):
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            close_old_connections()
+
+    def submit(self, func, *args):
+        """
+        run func in worker and wait for its result
+        :raise OrderException: queue is full
+        """
+        with self._lock:
+            if self._pending >= self._max_size:
+                raise OrderException("当前抢购人数过多，请稍后再试")
+            self._pending += 1
+        return self._executor.submit(self._run, func, *args).result()
+
+
+stock_tokens = StockTokens(FLASH_SALE_RESEED_SECONDS)
+admission_queue = AdmissionQueue(FLASH_SALE_WORKERS, FLASH_SALE_QUEUE_SIZE)
+
+
+def flash_sale_place_order(user: User, commodity: Commodity, num: int, para_ids: list[int], address: str = None,
+                           note: str = None) -> Order:
+    """
+    place order of a flash sale commodity, arguments are the same as place_order
+    """
+    if commodity.status == COMM_STATUS_PRE_SELL:
+        # 预售允许超卖，不需要计数
+        return place_order(user, commodity, num, para_ids, address, note)
+    if num <= 0:
+        raise InvalidOrderException()
+    if not stock_tokens.acquire(commodity.id, num):
+        raise SoldOutException()
+    try:
+        order = admission_queue.submit(place_order, user, commodity, num, para_ids, address, note)
+    except SoldOutException:
+        # 内存计数与数据库不一致（例如其他进程也在售卖），下次从数据库重新计数
+        stock_tokens.cancel(commodity.id, num)
+        stock_tokens.invalidate(commodity.id)
+        raise
+    except Exception:
+        stock_tokens.cancel(commodity.id, num)
+        raise
+    stock_tokens.complete(commodity.id, num)
+    return order
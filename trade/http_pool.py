@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from collections import deque
+
+import certifi
+import urllib3
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+# 每种请求保留最近的耗时样本用于计算分位数
+LATENCY_SAMPLES = 1024
+
+
+class StorageMetrics:
+    """
+    per process metrics of requests to object storage, the latency of a request is the time until its response
+    headers are received, so streaming the body of a download is not included.
+    requests are grouped by http method: GET download, PUT upload or upload part, HEAD stat,
+    DELETE remove, POST create or complete multipart upload
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._pool_waits = 0
+        self._pool_wait_seconds = 0.0
+        self._pool_timeouts = 0
+        self._operations = {}
+
+    def request_started(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+
+    def request_finished(self, operation: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            stat = self._operations.setdefault(operation, {"count": 0, "errors": 0, "total_seconds": 0.0,
+                                                           "max_seconds": 0.0,
+                                                           "samples": deque(maxlen=LATENCY_SAMPLES)})
+            stat["count"] += 1
+            stat["errors"] += 1 if failed else 0
+            stat["total_seconds"] += seconds
+            stat["max_seconds"] = max(stat["max_seconds"], seconds)
+            stat["samples"].append(seconds)
+
+    def pool_waited(self, seconds: float, timed_out: bool) -> None:
+        with self._lock:
+            self._pool_waits += 1
+            self._pool_wait_seconds += seconds
+            self._pool_timeouts += 1 if timed_out else 0
+
+    def snapshot(self) -> dict:
+        """
+        :return: current metrics, latencies are in milliseconds
+        """
+
+        def percentile(samples: list, ratio: float) -> float:
+            return round(samples[min(int(len(samples) * ratio), len(samples) - 1)] * 1000, 3)
+
+        with self._lock:
+            operations = {}
+            for operation, stat in self._operations.items():
+                samples = sorted(stat["samples"])
+                operations[operation] = {
+                    "count": stat["count"],
+                    "errors": stat["errors"],
+                    "avg_ms": round(stat["total_seconds"] / stat["count"] * 1000, 3),
+                    "max_ms": round(stat["max_seconds"] * 1000, 3),
+                    "p50_ms": percentile(samples, 0.5),
+                    "p95_ms": percentile(samples, 0.95),
+                    "p99_ms": percentile(samples, 0.99),
+                }
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+                "pool_waits": self._pool_waits,
+                "pool_wait_ms": round(self._pool_wait_seconds * 1000, 3),
+                "pool_timeouts": self._pool_timeouts,
+                "operations": operations,
+            }
+
+
+storage_metrics = StorageMetrics()
+
+
+class _InstrumentedPoolMixin:  # pylint:disable=R0903
+    """
+    records how long a request waits for a free connection of the pool
+    """
+
+    def _get_conn(self, timeout=None):
+        # 连接池中没有空闲连接时需要等待其他请求归还连接
+        if self.pool is None or self.pool.qsize() > 0:
+            return super()._get_conn(timeout)
+        start = time.perf_counter()
+        try:
+            conn = super()._get_conn(timeout)
+        except EmptyPoolError:
+            storage_metrics.pool_waited(time.perf_counter() - start, True)
+            raise
+        storage_metrics.pool_waited(time.perf_counter() - start, False)
+        return conn
+
+
+class _InstrumentedHTTPConnectionPool(_InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _InstrumentedHTTPSConnectionPool(_InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class StoragePoolManager(urllib3.PoolManager):
+    """
+    PoolManager with bounded blocking pools, every request records its latency into storage_metrics and waits
+    at most pool_timeout seconds for a free connection, so a stalled storage fails requests instead of
+    blocking all workers
+    """
+
+    def __init__(self, pool_timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_timeout = pool_timeout
+        self.pool_classes_by_scheme = {"http": _InstrumentedHTTPConnectionPool,
+                                       "https": _InstrumentedHTTPSConnectionPool}
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        kw.setdefault("pool_timeout", self.pool_timeout)
+        storage_metrics.request_started()
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = super().urlopen(method, url, redirect, **kw)
+            failed = response.status >= 400
+            return response
+        finally:
+            storage_metrics.request_finished(method, time.perf_counter() - start, failed)
+
+
+def create_storage_pool(pool_size: int, pool_timeout: float, connect_timeout: float, read_timeout: float,
+                        retries: int, retry_backoff: float) -> StoragePoolManager:
+    """
+    create http client for minio
+    :param pool_size: max connections per host, also the max concurrent requests per host
+    :param pool_timeout: seconds to wait for a free connection
+    :param connect_timeout: seconds to establish a connection
+    :param read_timeout: seconds to wait for data from server
+    :param retries: max retries of connection errors, read errors of idempotent requests and 5xx responses
+    :param retry_backoff: backoff factor of retries, the n-th retry sleeps retry_backoff * 2 ** (n - 1) seconds
+    :return: pool manager
+    """
+    return StoragePoolManager(
+        pool_timeout,
+        timeout=urllib3.util.Timeout(connect=connect_timeout, read=read_timeout),
+        maxsize=pool_size,
+        block=True,
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=retries, backoff_factor=retry_backoff, status_forcelist=[500, 502, 503, 504]),
+    )
@@ -0,0 +1,85 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from trade.exceptions import OrderException
+from trade.models.Commodity import Commodity, METHOD_ONLINE
+from trade.models.File import File
+from trade.models.Order import Order
+from trade.models.Shop import Shop, TYPE_PERSONAL
+from trade.models.User import User
+from trade.models.status import COMM_STATUS_ON_SELL
+from trade.order_util import place_order, set_sale_shards, sync_sale
+
+
+class Command(BaseCommand):
+    help = "下单并发压测：多个线程同时抢购同一个商品，检查是否超卖并输出吞吐量"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16, help="并发线程数")
+        parser.add_argument("--orders", type=int, default=500, help="下单请求总数")
+        parser.add_argument("--total", type=int, default=100, help="商品库存")
+        parser.add_argument("--num", type=int, default=1, help="每单购买数量")
+        parser.add_argument("--shards", type=int, default=0, help="销量分片数，0 为不分片")
+        parser.add_argument("--keep", action="store_true", help="保留压测数据")
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        file = File.objects.create(filename="bench.png", oss_token="bench/{}".format(suffix))
+        user = User.objects.create(username="bench_{}".format(suffix), password="", nickname="bench", email="")
+        shop = Shop.objects.create(name="bench_{}".format(suffix), type=TYPE_PERSONAL, owner=user, image=file)
+        commodity = Commodity.objects.create(name="bench", total=options["total"], price=1, discount=0, shop=shop,
+                                             method=METHOD_ONLINE, image=file, status=COMM_STATUS_ON_SELL)
+        if options["shards"] > 0:
+            set_sale_shards(commodity, options["shards"])
+            commodity.refresh_from_db()
+        results = {"success": 0, "sold_out": 0, "error": 0}
+
+        def worker(count: int) -> list[str]:
+            # 每个线程复用自己的数据库连接，结束时关闭
+            outcomes = []
+            try:
+                for _ in range(count):
+                    try:
+                        place_order(user, commodity, options["num"], [])
+                        outcomes.append("success")
+                    except OrderException:
+                        outcomes.append("sold_out")
+                    except DatabaseError:
+                        outcomes.append("error")
+            finally:
+                connection.close()
+            return outcomes
+
+        threads = options["threads"]
+        counts = [options["orders"] // threads + (1 if i < options["orders"] % threads else 0) for i in range(threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for outcomes in executor.map(worker, counts):
+                for outcome in outcomes:
+                    results[outcome] += 1
+        elapsed = time.perf_counter() - start
+
+        sync_sale(commodity.id)
+        commodity.refresh_from_db()
+        ordered = sum(Order.objects.filter(commodity=commodity).values_list("num", flat=True))
+        self.stdout.write("请求数: {}, 线程数: {}, 耗时: {:.3f}s, 吞吐量: {:.1f} 单/s".format(
+            options["orders"], options["threads"], elapsed, options["orders"] / elapsed))
+        self.stdout.write("成功: {}, 售罄: {}, 数据库错误: {}".format(
+            results["success"], results["sold_out"], results["error"]))
+        self.stdout.write("库存: {}, 已售: {}, 订单总量: {}, 商品状态: {}".format(
+            commodity.total, commodity.sale, ordered, commodity.get_status_display()))
+        if commodity.sale > commodity.total or commodity.sale != ordered:
+            self.stderr.write(self.style.ERROR("库存不一致！"))
+        else:
+            self.stdout.write(self.style.SUCCESS("库存一致"))
+
+        if not options["keep"]:
+            Order.objects.filter(commodity=commodity).delete()
+            commodity.delete()
+            shop.delete()
+            user.delete()
+            file.delete()
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trade.order_util import close_expired_orders, ORDER_PAY_TIMEOUT
+
+
+class Command(BaseCommand):
+    help = "关闭下单后超时未付款的订单并归还库存，可用 --interval 常驻运行"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="每个事务最多关闭的订单数")
+        parser.add_argument("--interval", type=float, default=0, help="常驻运行时的扫描间隔（秒），0 为只运行一次")
+
+    def handle(self, *args, **options):
+        while True:
+            closed = 0
+            while True:
+                count = close_expired_orders(options["batch_size"])
+                closed += count
+                if count < options["batch_size"]:
+                    break
+            if closed > 0 or options["interval"] <= 0:
+                self.stdout.write("关闭超过{}分钟未付款的订单{}个".format(
+                    int(ORDER_PAY_TIMEOUT.total_seconds() // 60), closed))
+            if options["interval"] <= 0:
+                return
+            close_old_connections()
+            time.sleep(options["interval"])
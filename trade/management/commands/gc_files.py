@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from trade.file_util import get_thumbnail_token
+from trade.models.File import File
+from trade.storage import get_storage
+
+
+def orphan_files(before):
+    """
+    files uploaded before the given time and not referenced by any foreign key or many to many field,
+    each reference is checked by a NOT EXISTS sub query, so new references are found automatically
+    :param before: grace period ends at this time
+    :return: QuerySet of File
+    """
+    query_set = File.all_objects.filter(upload_time__lt=before)
+    for relation in File._meta.related_objects:
+        referenced = relation.related_model.objects.filter(**{relation.field.name: OuterRef("pk")})
+        query_set = query_set.filter(~Exists(referenced))
+    return query_set
+
+
+class Command(BaseCommand):
+    help = "删除超过宽限期且没有被用户、店铺、商品、评论、认证申请引用的文件，以及不再被任何文件共享的对象"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=float, default=24, help="上传后多少小时内的文件不会被删除")
+        parser.add_argument("--batch-size", type=int, default=500, help="每个事务最多删除的文件数")
+        parser.add_argument("--dry-run", action="store_true", help="只统计不删除")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options["grace_hours"])
+        if options["dry_run"]:
+            self.stdout.write("可删除的文件: {}".format(orphan_files(before).count()))
+            return
+        storage = get_storage()
+        last_id = 0
+        deleted, failed = 0, []
+        while True:
+            ids = list(orphan_files(before).filter(id__gt=last_id).order_by("id")
+                       .values_list("id", flat=True)[:options["batch_size"]])
+            if len(ids) == 0:
+                break
+            last_id = ids[-1]
+            with transaction.atomic():
+                # 加锁后重新检查引用，加锁期间其他事务无法引用这些文件
+                files = list(orphan_files(before).select_for_update().filter(id__in=ids)
+                             .values_list("id", "oss_token", "has_thumbnail"))
+                File.all_objects.filter(id__in=[file[0] for file in files]).delete()
+                # 内容相同的上传共享同一个对象，还有其他记录引用的对象不能删除。
+                # 上传时会锁住被共享的记录，所以这里能看到已提交的新记录；新记录的上传时间在宽限期内，不会被删除
+                shared = set(File.all_objects.select_for_update().filter(oss_token__in=[file[1] for file in files])
+                             .values_list("oss_token", flat=True))
+            removed = {file[1]: file[2] for file in files if file[1] not in shared}
+            oss_tokens = list(removed.keys())
+            oss_tokens += [get_thumbnail_token(oss_token) for oss_token, has_thumbnail in removed.items()
+                           if has_thumbnail]
+            failed += storage.remove_objects(oss_tokens)
+            deleted += len(files)
+        self.stdout.write("删除文件: {}".format(deleted))
+        if len(failed) > 0:
+            self.stderr.write(self.style.ERROR("{}个对象删除失败: {}".format(len(failed), ", ".join(failed[:20]))))
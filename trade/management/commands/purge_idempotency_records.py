@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from trade.util import purge_idempotency_records, IDEMPOTENCY_KEY_TTL
+
+
+class Command(BaseCommand):
+    help = "删除超过有效期的幂等请求记录，建议定时运行"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="每条语句最多删除的记录数")
+
+    def handle(self, *args, **options):
+        deleted = 0
+        while True:
+            count = purge_idempotency_records(options["batch_size"])
+            deleted += count
+            if count < options["batch_size"]:
+                break
+        self.stdout.write("删除超过{}小时的幂等请求记录{}条".format(
+            int(IDEMPOTENCY_KEY_TTL.total_seconds() // 3600), deleted))
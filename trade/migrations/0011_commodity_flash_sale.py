@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0010_alter_article_post_time_alter_articleop_op_time_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commodity",
+            name="flash_sale",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.2 on 2026-10-19 14:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0011_commodity_flash_sale"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commodity",
+            name="sale_shards",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="SaleShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.IntegerField()),
+                ("total", models.IntegerField()),
+                ("sale", models.IntegerField(default=0)),
+                (
+                    "commodity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="trade.commodity",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("commodity", "index")},
+            },
+        ),
+    ]
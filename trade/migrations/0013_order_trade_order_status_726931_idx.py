@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-19 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0012_commodity_sale_shards_saleshard"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "start_time"], name="trade_order_status_726931_idx"
+            ),
+        ),
+    ]
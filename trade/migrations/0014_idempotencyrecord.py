@@ -0,0 +1,45 @@
+# Generated by Django 4.1.2 on 2026-10-19 14:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0013_order_trade_order_status_726931_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64)),
+                ("endpoint", models.CharField(max_length=100)),
+                ("response", models.TextField(null=True)),
+                (
+                    "create_time",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="trade.user"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "key", "endpoint")},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.2 on 2026-10-19 15:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_shop(apps, schema_editor):
+    Order = apps.get_model("trade", "Order")
+    Commodity = apps.get_model("trade", "Commodity")
+    Order.objects.update(
+        shop_id=models.Subquery(
+            Commodity.objects.filter(id=models.OuterRef("commodity_id")).values("shop_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0014_idempotencyrecord"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="shop",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="trade.shop",
+            ),
+        ),
+        migrations.RunPython(fill_order_shop, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="order",
+            name="shop",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT, to="trade.shop"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["shop", "status", "start_time"],
+                name="trade_order_shop_id_caf4d6_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:00
+
+from django.db import migrations, models
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0015_order_shop"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="file",
+            managers=[
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="status",
+            field=models.IntegerField(choices=[(0, "等待上传"), (1, "已上传")], default=1),
+        ),
+    ]
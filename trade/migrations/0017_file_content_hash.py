@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0016_file_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="content_hash",
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+    ]
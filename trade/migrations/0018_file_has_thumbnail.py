@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0017_file_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="has_thumbnail",
+            field=models.BooleanField(default=False),
+        ),
+    ]
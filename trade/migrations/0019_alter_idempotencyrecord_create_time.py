@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-19 20:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0018_file_has_thumbnail"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="idempotencyrecord",
+            name="create_time",
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trade", "0019_alter_idempotencyrecord_create_time"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="image_type",
+            field=models.CharField(max_length=20, null=True),
+        ),
+    ]
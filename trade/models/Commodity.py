@@ -22,6 +22,8 @@ class Commodity(models.Model):
     method: 交易方式
     image: 主预览图
     image_set: 详情页图片
+    flash_sale: 是否开启秒杀模式，开启后下单请求先经过内存中的库存计数和排队
+    sale_shards: 销量分片数，为 0 时不分片；分片时 sale 为快照，实际销量为各分片之和
     """
     METHODS = [
         (METHOD_ONLINE, "线上交易"),
@@ -40,3 +42,5 @@ class Commodity(models.Model):
     method = models.IntegerField(choices=METHODS)
     image = models.ForeignKey(to=File, on_delete=models.PROTECT, related_name="main_image")
     image_set = models.ManyToManyField(to=File)
+    flash_sale = models.BooleanField(default=False)
+    sale_shards = models.IntegerField(default=0)
@@ -1,6 +1,17 @@
 from django.db import models
 from django.utils import timezone
 
+from trade.models.status import FILE_STATUSES, FILE_STATUS_ACTIVE
+
+
+class ActiveFileManager(models.Manager):  # pylint:disable=R0903
+    """
+    只包含已上传完成的文件
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(status=FILE_STATUS_ACTIVE)
+
 
 class File(models.Model):
     """
@@ -8,7 +19,20 @@ class File(models.Model):
     filename: 图片文件名
     oss_token: 用于在 s3 存储桶中定位
     upload_time: 上传时间
+    status: 文件状态，直传时先创建等待上传的记录，上传完成后生效
+    content_hash: 文件内容的 sha256，内容相同的文件只保存一份对象，每次上传各有一条记录并共享 oss_token，
+                  直传的文件在完成上传时计算，不与已有对象合并
+    has_thumbnail: 是否已生成缩略图，缩略图保存在 "{oss_token}@thumb.webp"
+    image_type: 由文件头判断的图片类型，只有 jpeg、png、gif、webp 图片可以通过公开 url 访问，其他文件为空
     """
     filename = models.CharField(max_length=100)
     oss_token = models.CharField(max_length=300)
     upload_time = models.DateTimeField(default=timezone.now)
+    status = models.IntegerField(choices=FILE_STATUSES, default=FILE_STATUS_ACTIVE)
+    content_hash = models.CharField(max_length=64, null=True, db_index=True)
+    has_thumbnail = models.BooleanField(default=False)
+    image_type = models.CharField(max_length=20, null=True)
+
+    # 第一个 manager 为默认 manager，关联查询时仍可访问到所有文件
+    all_objects = models.Manager()
+    objects = ActiveFileManager()
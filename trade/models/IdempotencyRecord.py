@@ -0,0 +1,23 @@
+from django.db import models
+from django.utils import timezone
+
+from trade.models.User import User
+
+
+class IdempotencyRecord(models.Model):
+    """
+    幂等请求记录：
+    user: 请求用户
+    key: 请求头 Idempotency-Key 的值
+    endpoint: 请求路径
+    response: 第一次请求的响应（json），为空表示第一次请求还在处理中
+    create_time: 创建时间，超过有效期的记录会被新请求替换，或由 purge_idempotency_records 命令删除
+    """
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    endpoint = models.CharField(max_length=100)
+    response = models.TextField(null=True)
+    create_time = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ("user", "key", "endpoint")
@@ -3,6 +3,7 @@ from django.utils import timezone
 
 from trade.models.Commodity import Commodity
 from trade.models.Parameter import Parameter
+from trade.models.Shop import Shop
 from trade.models.User import User
 from trade.models.status import ORDER_STATUSES, ORDER_STATUS_ORDERED
 
@@ -12,6 +13,7 @@ class Order(models.Model):
     订单模型：
     user: 下单的人
     commodity: 下单商品，不许一单多个商品，没有购物车
+    shop: 商品所属店铺，下单时从 commodity 冗余保存，用于按店铺查询
     status: 状态，有：已下单、已支付、已送达、已确认、已评价、已关闭（已关闭是下单了但是15min内没付款）
     price: 单价
     num: 数量，订单金额 = num * price
@@ -26,6 +28,7 @@ class Order(models.Model):
     """
     user = models.ForeignKey(to=User, on_delete=models.PROTECT)
     commodity = models.ForeignKey(to=Commodity, on_delete=models.PROTECT)
+    shop = models.ForeignKey(to=Shop, on_delete=models.PROTECT)
     status = models.IntegerField(choices=ORDER_STATUSES, default=ORDER_STATUS_ORDERED)
     price = models.DecimalField(max_digits=8, decimal_places=2)
     num = models.IntegerField()
@@ -37,3 +40,9 @@ class Order(models.Model):
     close_time = models.DateTimeField(null=True)
     select_paras = models.ManyToManyField(to=Parameter)
     note = models.TextField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "start_time"]),
+            models.Index(fields=["shop", "status", "start_time"]),
+        ]
@@ -0,0 +1,20 @@
+from django.db import models
+
+from trade.models.Commodity import Commodity
+
+
+class SaleShard(models.Model):
+    """
+    商品销量分片：
+    commodity: 商品
+    index: 分片序号，从 0 开始
+    total: 分到该分片的库存
+    sale: 该分片的已售量，商品销量 = 所有分片 sale 之和
+    """
+    commodity = models.ForeignKey(to=Commodity, on_delete=models.CASCADE)
+    index = models.IntegerField()
+    total = models.IntegerField()
+    sale = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("commodity", "index")
@@ -4,9 +4,11 @@ from .Comment import Comment
 from .Commodity import Commodity
 from .CommCollectRecord import CommCollectRecord
 from .File import File
+from .IdempotencyRecord import IdempotencyRecord
 from .Log import Log
 from .Order import Order
 from .Reply import Reply
+from .SaleShard import SaleShard
 from .Shop import Shop
 from .StuAuthReq import StuAuthReq
 from .Student import Student
@@ -41,3 +41,11 @@ ORDER_STATUSES = [
     (ORDER_STATUS_COMMENTED, "已评价"),
     (ORDER_STATUS_CLOSED, "已关闭"),
 ]
+
+FILE_STATUS_PENDING = 0
+FILE_STATUS_ACTIVE = 1
+
+FILE_STATUSES = [
+    (FILE_STATUS_PENDING, "等待上传"),
+    (FILE_STATUS_ACTIVE, "已上传"),
+]
@@ -0,0 +1,423 @@
+import random
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction, connection
+from django.db.models import F, Q, Sum, Count, Case, When, Value, IntegerField
+from django.utils import timezone
+
+from trade.exceptions import OrderException, InvalidOrderException, InvalidParameterException, SoldOutException
+from trade.models.Commodity import Commodity
+from trade.models.Order import Order
+from trade.models.Parameter import Parameter
+from trade.models.SaleShard import SaleShard
+from trade.models.User import User
+from trade.models.status import COMM_STATUS_ON_SELL, COMM_STATUS_PRE_SELL, COMM_STATUS_CLOSED, \
+    ORDER_STATUS_ORDERED, ORDER_STATUS_PAID, ORDER_STATUS_DELIVERED, ORDER_STATUS_CONFIRMED, ORDER_STATUS_COMMENTED, \
+    ORDER_STATUS_CLOSED, ORDER_STATUS_DICT
+
+# Order.price 为 Decimal(8, 2)，整数部分最多 6 位
+MAX_ORDER_PRICE = Decimal("999999.99")
+# 订单数量统计的缓存时间（秒），默认缓存为进程内缓存，其他进程（如 close_expired_orders）中的失效只能等待过期
+ORDER_SUMMARY_TTL = 30
+# 下单后未在该时间内付款的订单会被关闭
+ORDER_PAY_TIMEOUT = timedelta(minutes=15)
+
+# 订单状态机，动作: (原状态, 目标状态, 记录时间的字段)
+ORDER_TRANSITIONS = {
+    "pay": (ORDER_STATUS_ORDERED, ORDER_STATUS_PAID, "pay_time"),
+    "deliver": (ORDER_STATUS_PAID, ORDER_STATUS_DELIVERED, "deliver_time"),
+    "confirm": (ORDER_STATUS_DELIVERED, ORDER_STATUS_CONFIRMED, "confirm_time"),
+    "comment": (ORDER_STATUS_CONFIRMED, ORDER_STATUS_COMMENTED, None),
+    "close": (ORDER_STATUS_ORDERED, ORDER_STATUS_CLOSED, "close_time"),
+}
+
+
+def get_unit_price(commodity: Commodity, para_ids: list[int]) -> Decimal:
+    """
+    price one unit of commodity with selected parameters in one query
+    :param commodity: commodity
+    :param para_ids: ids of selected parameters, all of them must belong to the commodity
+    :return: unit price
+    """
+    unit_price = commodity.price - commodity.discount
+    if len(para_ids) == 0:
+        return unit_price
+    if len(set(para_ids)) != len(para_ids):
+        raise InvalidParameterException()
+    paras = Parameter.objects.filter(id__in=para_ids, para_set__commodity_id=commodity.id) \
+        .aggregate(count=Count("id"), add=Sum("add"))
+    if paras["count"] != len(para_ids):
+        raise InvalidParameterException()
+    return unit_price + paras["add"]
+
+
+def get_stock(commodity_id: int) -> int:
+    """
+    get remaining stock of an on-sell commodity
+    :param commodity_id: commodity id
+    :return: total - sale, 0 if the commodity is not on sell
+    """
+    commodity = Commodity.objects.filter(id=commodity_id, status=COMM_STATUS_ON_SELL).first()
+    if commodity is None:
+        return 0
+    return max(commodity.total - get_sale(commodity), 0)
+
+
+def get_sale(commodity: Commodity) -> int:
+    """
+    get current sale of commodity, sum of shards if the sale counter is sharded
+    :param commodity: commodity
+    :return: sale
+    """
+    if commodity.sale_shards == 0:
+        return commodity.sale
+    return SaleShard.objects.filter(commodity_id=commodity.id).aggregate(sale=Sum("sale"))["sale"] or 0
+
+
+def sync_sale(commodity_id: int) -> None:
+    """
+    write the sum of shards back to Commodity.sale, which is a snapshot for lists and filters
+    :param commodity_id: commodity id
+    :return: None
+    """
+    sale = SaleShard.objects.filter(commodity_id=commodity_id).aggregate(sale=Sum("sale"))["sale"]
+    if sale is not None:
+        Commodity.objects.filter(id=commodity_id).update(sale=sale)
+
+
+def set_sale_shards(commodity: Commodity, shards: int) -> None:
+    """
+    split the sale counter of commodity into shards, or merge it back when shards is 0
+    total and current sale are spread evenly over the shards
+    :param commodity: commodity
+    :param shards: number of shards
+    :return: None
+    """
+    with transaction.atomic():
+        commodity = Commodity.objects.select_for_update().get(id=commodity.id)
+        old_shards = list(SaleShard.objects.select_for_update().filter(commodity_id=commodity.id))
+        sale = sum(shard.sale for shard in old_shards) if commodity.sale_shards > 0 else commodity.sale
+        SaleShard.objects.filter(commodity_id=commodity.id).delete()
+        SaleShard.objects.bulk_create([
+            SaleShard(commodity_id=commodity.id, index=index,
+                      total=commodity.total // shards + (1 if index < commodity.total % shards else 0),
+                      sale=sale // shards + (1 if index < sale % shards else 0))
+            for index in range(shards)
+        ])
+        Commodity.objects.filter(id=commodity.id).update(sale=sale, sale_shards=shards)
+
+
+def _reserve_shards(commodity: Commodity, num: int) -> bool:
+    shards = SaleShard.objects.filter(commodity_id=commodity.id)
+    indexes = random.sample(range(commodity.sale_shards), commodity.sale_shards)
+    if commodity.status == COMM_STATUS_PRE_SELL:
+        return shards.filter(index=indexes[0]).update(sale=F("sale") + num) == 1
+    if commodity.status != COMM_STATUS_ON_SELL:
+        return False
+    for index in indexes:
+        if shards.filter(index=index, sale__lte=F("total") - num).update(sale=F("sale") + num) == 1:
+            return True
+    # 没有单个分片能满足时，锁住全部分片跨分片扣减
+    locked = list(shards.select_for_update().order_by("index"))
+    if sum(max(shard.total - shard.sale, 0) for shard in locked) < num:
+        return False
+    for shard in locked:
+        take = min(num, max(shard.total - shard.sale, 0))
+        if take > 0:
+            SaleShard.objects.filter(id=shard.id).update(sale=F("sale") + take)
+            num -= take
+        if num == 0:
+            break
+    return True
+
+
+def _release_shards(commodity_id: int, shard_count: int, num: int) -> None:
+    shards = SaleShard.objects.filter(commodity_id=commodity_id)
+    for index in random.sample(range(shard_count), shard_count):
+        if shards.filter(index=index, sale__gte=num).update(sale=F("sale") - num) == 1:
+            return
+    for shard in shards.select_for_update().order_by("index"):
+        take = min(num, shard.sale)
+        if take > 0:
+            SaleShard.objects.filter(id=shard.id).update(sale=F("sale") - take)
+            num -= take
+        if num == 0:
+            return
+
+
+def reserve_stock(commodity: Commodity, num: int) -> bool:
+    """
+    reserve stock with conditional updates, pre-sell commodities can be oversold
+    without shards the commodity row is updated, otherwise a random shard (or several shards when no single
+    shard has enough stock) is updated
+    :param commodity: commodity
+    :param num: number to reserve
+    :return: True if reserved else False
+    """
+    if commodity.sale_shards > 0:
+        return _reserve_shards(commodity, num)
+    on_sell = Q(status=COMM_STATUS_ON_SELL, sale__lte=F("total") - num)
+    pre_sell = Q(status=COMM_STATUS_PRE_SELL)
+    return Commodity.objects.filter(on_sell | pre_sell, id=commodity.id).update(sale=F("sale") + num) == 1
+
+
+def release_stocks(released: dict[int, int]) -> None:
+    """
+    give back reserved stock of several commodities, and put commodities on sell again if they are closed
+    because of sold out. commodities without shards are updated by one statement
+    :param released: dict maps commodity id to number to release
+    :return: None
+    """
+    if len(released) == 0:
+        return
+    shard_counts = dict(Commodity.objects.filter(id__in=released.keys(), sale_shards__gt=0)
+                        .values_list("id", "sale_shards"))
+    for commodity_id, shard_count in shard_counts.items():
+        _release_shards(commodity_id, shard_count, released[commodity_id])
+        sync_sale(commodity_id)
+    plain = {commodity_id: num for commodity_id, num in released.items() if commodity_id not in shard_counts}
+    if len(plain) > 0:
+        Commodity.objects.filter(id__in=plain.keys()).update(sale=F("sale") - Case(
+            *[When(id=commodity_id, then=Value(num)) for commodity_id, num in plain.items()],
+            output_field=IntegerField()))
+    Commodity.objects.filter(id__in=released.keys(), status=COMM_STATUS_CLOSED, sale__lt=F("total")) \
+        .update(status=COMM_STATUS_ON_SELL)
+
+
+def release_stock(commodity_id: int, num: int) -> None:
+    """
+    give back reserved stock of one commodity, see release_stocks
+    :param commodity_id: commodity id
+    :param num: number to release
+    :return: None
+    """
+    release_stocks({commodity_id: num})
+
+
+def _order_summary_key(owner: str, owner_id: int) -> str:
+    return "order_summary:{}:{}".format(owner, owner_id)
+
+
+def invalidate_order_summary(user_ids, shop_ids) -> None:
+    """
+    drop cached order summaries of users and shops whose orders are changed, after the current transaction commits
+    :param user_ids: iterable of user id
+    :param shop_ids: iterable of shop id
+    :return: None
+    """
+    keys = [_order_summary_key("user", user_id) for user_id in user_ids] + \
+           [_order_summary_key("shop", shop_id) for shop_id in shop_ids]
+    if len(keys) > 0:
+        # 在事务提交后再删除，避免其他请求在提交前把旧数据重新写入缓存
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_order_summary(owner: str, owner_id: int) -> dict:
+    """
+    count orders of a user or a shop by status with one GROUP BY query, cached for ORDER_SUMMARY_TTL seconds
+    :param owner: "user" or "shop"
+    :param owner_id: user id or shop id
+    :return: dict maps every order status to count
+    """
+    key = _order_summary_key(owner, owner_id)
+    summary = cache.get(key)
+    if summary is None:
+        counts = dict(Order.objects.filter(**{"{}_id".format(owner): owner_id}).values("status")
+                      .annotate(count=Count("id")).values_list("status", "count"))
+        summary = {status: counts.get(status, 0) for status in ORDER_STATUS_DICT}
+        cache.set(key, summary, ORDER_SUMMARY_TTL)
+    return summary
+
+
+def place_order(user: User, commodity: Commodity, num: int, para_ids: list[int], address: str = None,
+                note: str = None) -> Order:
+    """
+    place an order in one transaction: reserve stock, create order and its selected parameters,
+    and close the commodity when it is sold out
+    :param user: buyer
+    :param commodity: commodity to buy
+    :param num: number to buy
+    :param para_ids: ids of selected parameters
+    :param address: address, optional
+    :param note: note, optional
+    :return: created order
+    """
+    if num <= 0:
+        raise InvalidOrderException()
+    price = get_unit_price(commodity, para_ids) * num
+    if price > MAX_ORDER_PRICE:
+        raise InvalidOrderException()
+    with transaction.atomic():
+        reserved = reserve_stock(commodity, num)
+        if reserved:
+            order = Order.objects.create(user=user, commodity=commodity, shop_id=commodity.shop_id, num=num,
+                                         price=price, address=address, note=note)
+            through = Order.select_paras.through
+            through.objects.bulk_create([through(order_id=order.id, parameter_id=para_id) for para_id in para_ids])
+            if commodity.sale_shards == 0:
+                Commodity.objects.filter(id=commodity.id, status=COMM_STATUS_ON_SELL, sale__gte=F("total")) \
+                    .update(status=COMM_STATUS_CLOSED)
+    if reserved:
+        invalidate_order_summary([user.id], [commodity.shop_id])
+        return order
+    status = Commodity.objects.filter(id=commodity.id).values_list("status", flat=True).first()
+    if status not in (COMM_STATUS_ON_SELL, COMM_STATUS_CLOSED):
+        raise OrderException("商品当前不可购买")
+    if commodity.sale_shards > 0:
+        # 分片时商品行上没有实时销量，售罄时同步快照并下架
+        sync_sale(commodity.id)
+        Commodity.objects.filter(id=commodity.id, status=COMM_STATUS_ON_SELL, sale__gte=F("total")) \
+            .update(status=COMM_STATUS_CLOSED)
+    raise SoldOutException()
+
+
+def checkout(user: User, lines: list[dict], address: str = None, note: str = None) -> list[Order]:
+    """
+    place one order for each line in one transaction, all lines succeed or none does
+    commodities are locked in the order of their ids, all of them and their parameters are priced in two queries
+    :param user: buyer
+    :param lines: list of {"commodity_id": int, "num": int, "select_paras": list[int]}
+    :param address: address, optional
+    :param note: note, optional
+    :return: created orders, in the same order as lines
+    """
+    if len(lines) == 0 or any(line["num"] <= 0 for line in lines):
+        raise InvalidOrderException()
+    commodities = Commodity.objects.in_bulk({line["commodity_id"] for line in lines})
+    if len(commodities) != len({line["commodity_id"] for line in lines}):
+        raise OrderException("商品不存在")
+    para_ids = [para_id for line in lines for para_id in line["select_paras"]]
+    paras = {para_id: (commodity_id, add) for para_id, commodity_id, add in
+             Parameter.objects.filter(id__in=para_ids).values_list("id", "para_set__commodity_id", "add")}
+    prices = []
+    for line in lines:
+        commodity = commodities[line["commodity_id"]]
+        if len(set(line["select_paras"])) != len(line["select_paras"]) or \
+                any(paras.get(para_id, (None,))[0] != commodity.id for para_id in line["select_paras"]):
+            raise InvalidParameterException()
+        unit_price = commodity.price - commodity.discount + sum(paras[para_id][1] for para_id in line["select_paras"])
+        prices.append(unit_price * line["num"])
+        if prices[-1] > MAX_ORDER_PRICE:
+            raise InvalidOrderException()
+
+    with transaction.atomic():
+        for line in sorted(lines, key=lambda x: x["commodity_id"]):
+            commodity = commodities[line["commodity_id"]]
+            if not reserve_stock(commodity, line["num"]):
+                raise OrderException("很抱歉，商品{}库存不足".format(commodity.name))
+        orders = [Order(user=user, commodity=commodities[line["commodity_id"]],
+                        shop_id=commodities[line["commodity_id"]].shop_id, num=line["num"], price=price,
+                        address=address, note=note) for line, price in zip(lines, prices)]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Order.objects.bulk_create(orders)
+        else:
+            # MySQL 不能在批量插入后返回主键
+            for order in orders:
+                order.save()
+        through = Order.select_paras.through
+        through.objects.bulk_create([through(order_id=order.id, parameter_id=para_id)
+                                     for order, line in zip(orders, lines) for para_id in line["select_paras"]])
+        Commodity.objects.filter(id__in=commodities.keys(), sale_shards=0, status=COMM_STATUS_ON_SELL,
+                                 sale__gte=F("total")).update(status=COMM_STATUS_CLOSED)
+    invalidate_order_summary([user.id], {order.shop_id for order in orders})
+    return orders
+
+
+def transit_order(order_id: int, action: str, user_id: int = None, shop_id: int = None, **conditions) -> bool:
+    """
+    change order status by one conditional update, only status and the time field of the action are written.
+    when the buyer or the shop is not given, the changed order is read again by primary key to find it,
+    so that the order summaries of both owners are dropped
+    :param order_id: order id
+    :param action: key of ORDER_TRANSITIONS
+    :param user_id: id of the buyer the order must belong to, None if not checked
+    :param shop_id: id of the shop the order must belong to, None if not checked
+    :param conditions: extra conditions, e.g. start_time__gte
+    :return: True if changed, False if the order does not exist, is not in the source status or does not match
+    """
+    source, target, time_field = ORDER_TRANSITIONS[action]
+    values = {"status": target}
+    if time_field is not None:
+        values[time_field] = timezone.now()
+    if user_id is not None:
+        conditions["user_id"] = user_id
+    if shop_id is not None:
+        conditions["shop_id"] = shop_id
+    if Order.objects.filter(id=order_id, status=source, **conditions).update(**values) == 0:
+        return False
+    if user_id is None or shop_id is None:
+        user_id, shop_id = Order.objects.filter(id=order_id).values_list("user_id", "shop_id").get()
+    invalidate_order_summary([user_id], [shop_id])
+    return True
+
+
+def bulk_transit_orders(order_ids: list[int], action: str, **conditions) -> tuple[dict[int, bool], dict[int, int]]:
+    """
+    change status of several orders by one conditional update, see transit_order
+    closed orders give back their stock
+    :param order_ids: order ids
+    :param action: key of ORDER_TRANSITIONS
+    :param conditions: extra conditions, e.g. shop_id, orders not matching are left out of the result
+    :return: dict maps id of every matching order to whether it is changed,
+    dict maps commodity id to number of stock given back by closed orders
+    """
+    source, target, time_field = ORDER_TRANSITIONS[action]
+    values = {"status": target}
+    if time_field is not None:
+        values[time_field] = timezone.now()
+    released = defaultdict(int)
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(id__in=order_ids, **conditions)
+                      .values_list("id", "status", "commodity_id", "num", "user_id", "shop_id"))
+        eligible = [order for order in orders if order[1] == source]
+        Order.objects.filter(id__in=[order[0] for order in eligible], status=source).update(**values)
+        if target == ORDER_STATUS_CLOSED:
+            for _, _, commodity_id, num, _, _ in eligible:
+                released[commodity_id] += num
+            release_stocks(released)
+    invalidate_order_summary({order[4] for order in eligible}, {order[5] for order in eligible})
+    return {order[0]: order[1] == source for order in orders}, dict(released)
+
+
+def cancel_order(order: Order) -> bool:
+    """
+    close an unpaid order and give back its stock in one transaction
+    :param order: order to close
+    :return: True if closed, False if the order is not unpaid any more
+    """
+    with transaction.atomic():
+        if not transit_order(order.id, "close", user_id=order.user_id, shop_id=order.shop_id):
+            return False
+        release_stock(order.commodity_id, order.num)
+    return True
+
+
+def close_expired_orders(batch_size: int = 500) -> int:
+    """
+    close at most batch_size orders which are not paid in ORDER_PAY_TIMEOUT and give back their stock,
+    rows locked by other transactions (e.g. being paid) are skipped if the database supports SKIP LOCKED
+    (MySQL 8.0.1+), otherwise the scan waits for them
+    :param batch_size: max number of orders to close
+    :return: number of closed orders
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # MySQL 8.0.1 之前不支持 SKIP LOCKED，退化为等待其他事务释放行锁
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        expired = list(Order.objects.select_for_update(skip_locked=skip_locked)
+                       .filter(status=ORDER_STATUS_ORDERED, start_time__lt=now - ORDER_PAY_TIMEOUT)
+                       .order_by("start_time").values_list("id", "commodity_id", "num", "user_id", "shop_id")
+                       [:batch_size])
+        if len(expired) == 0:
+            return 0
+        Order.objects.filter(id__in=[order[0] for order in expired], status=ORDER_STATUS_ORDERED) \
+            .update(status=ORDER_STATUS_CLOSED, close_time=now)
+        released = defaultdict(int)
+        for _, commodity_id, num, _, _ in expired:
+            released[commodity_id] += num
+        release_stocks(released)
+    invalidate_order_summary({order[3] for order in expired}, {order[4] for order in expired})
+    return len(expired)
@@ -204,6 +204,49 @@ def query_page(default: int = 10):
     return decorator
 
 
+def query_ids(max_count: int = 50):
+    """parse id list in query string
+
+    Args:
+        max_count (int, optional): max number of ids in one request. Defaults to 50.
+
+    Example of Usage:
+        @response_wrapper
+        @require_GET
+        @query_ids(max_count=50)
+        def multi_get_items(request: HttpRequest, *args, **kwargs):
+            items = Model.objects.filter(id__in=kwargs.get("ids"))
+            data = {item.id: item_to_dict(item) for item in items}
+            return success_api_response(data)
+
+    Query String:
+        pattern: ids=int,int,...
+        example uri: ?ids=1,2,3
+            corresponding list:
+            [1, 2, 3]
+    """
+
+    def decorator(func):
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            ids_value = request.GET.get("ids")
+            if ids_value is None or ids_value == "":
+                return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "Sorry, ids is required.")
+            try:
+                ids = list(dict.fromkeys(int(item) for item in ids_value.split(",")))
+            except ValueError:
+                return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS,
+                                           "Sorry, ids should be integers separated by comma.")
+            if len(ids) > max_count:
+                return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS,
+                                           "Sorry, at most {} ids are allowed.".format(max_count))
+            kwargs.update({"ids": ids})
+            return func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def default_distinct_helper(request: HttpRequest, model: Model, distinct_field, *args, **kwargs):
     """
     Args:
@@ -285,7 +328,8 @@ def filter_order_and_list(query_set: QuerySet, model_to_dict, **kwargs) -> dict:
     """
     filter and order a query_set and return the given page data
     :param query_set: query set needed to filter and order
-    :param model_to_dict: a function to map model to dict
+    :param model_to_dict: a function to map model to dict, return a FieldDict with lazy values so that
+        the fields not required by the `fields` query parameter are never computed
     :param kwargs: kwargs from origin function
     :return: a data dict
     """
@@ -0,0 +1,356 @@
+import abc
+import functools
+import mmap
+import os
+import shutil
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from django.utils.crypto import salted_hmac, constant_time_compare
+from django.utils.http import http_date
+from minio import Minio, __version__ as minio_version
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+from DBProject.settings import S3_SSL, S3_SECRET_ID, S3_SECRET_KEY, S3_ADDRESS, S3_BUCKET_NAME, STORAGE_BACKEND, \
+    LOCAL_STORAGE_DIR, LOCAL_STORAGE_URL, S3_POOL_SIZE, S3_POOL_TIMEOUT, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT, \
+    S3_RETRIES, S3_RETRY_BACKOFF
+from trade.exceptions import InvalidRangeException
+from trade.http_pool import create_storage_pool
+
+STORAGE_CHUNK_SIZE = 64 * 1024
+# 分片上传调用的 Minio 内部方法只在该版本上验证过，与 requirements.txt 中固定的版本一致
+MINIO_MULTIPART_VERSION = "7.0.4"
+
+ObjectStat = namedtuple("ObjectStat", ["size", "etag", "last_modified"])
+
+
+class Storage(abc.ABC):
+    """
+    interface of object storage, objects are located by oss_token
+    """
+
+    @abc.abstractmethod
+    def stat(self, oss_token: str):
+        """
+        :return: ObjectStat, None if object does not exist
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_object(self, oss_token: str, offset: int = 0, length: int = 0):
+        """
+        read object chunk by chunk, length 0 means to the end of object
+        :return: (iterator of chunks which releases the object when closed, dict of http headers among
+        Content-Length, ETag, Last-Modified and Content-Range)
+        :raise InvalidRangeException: offset is out of object
+        """
+        raise NotImplementedError()
+
+    def read(self, oss_token: str) -> bytes:
+        """
+        read the whole object into memory
+        """
+        chunks = self.get_object(oss_token)[0]
+        try:
+            return b"".join(chunks)
+        finally:
+            chunks.close()
+
+    @abc.abstractmethod
+    def put_object(self, oss_token: str, data, size: int, content_type: str = "application/octet-stream") -> None:
+        """
+        :param data: file-like object
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def remove_object(self, oss_token: str) -> None:
+        raise NotImplementedError()
+
+    def remove_objects(self, oss_tokens: list[str]) -> list[str]:
+        """
+        remove several objects, objects which do not exist are ignored
+        :return: oss_tokens failed to remove
+        """
+        failed = []
+        for oss_token in oss_tokens:
+            try:
+                self.remove_object(oss_token)
+            except Exception:
+                failed.append(oss_token)
+        return failed
+
+    @abc.abstractmethod
+    def download_url(self, oss_token: str, expires: timedelta, request_date: datetime = None) -> str:
+        """
+        url for front-end to download object directly
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def upload_url(self, oss_token: str, expires: timedelta) -> str:
+        """
+        url for front-end to put object directly
+        """
+        raise NotImplementedError()
+
+    def supports_multipart(self) -> bool:
+        """
+        whether the multipart methods below can be used, big uploads are kept by django otherwise
+        """
+        return True
+
+    @abc.abstractmethod
+    def create_multipart_upload(self, oss_token: str) -> str:
+        """
+        :return: upload_id
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def upload_part(self, oss_token: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        :param part_number: starts from 1
+        :return: etag of part
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def complete_multipart_upload(self, oss_token: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+        """
+        :param parts: list of (part_number, etag)
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def abort_multipart_upload(self, oss_token: str, upload_id: str) -> None:
+        raise NotImplementedError()
+
+
+class MinioStorage(Storage):
+    """
+    objects are stored in a bucket of minio or other s3 compatible storage
+    """
+
+    def __init__(self, address: str, access_key: str, secret_key: str, secure: bool, bucket_name: str,
+                 http_client=None):
+        self.client = Minio(address, access_key=access_key, secret_key=secret_key, secure=secure,
+                            http_client=http_client)
+        self.bucket_name = bucket_name
+
+    def stat(self, oss_token: str):
+        try:
+            stat = self.client.stat_object(self.bucket_name, oss_token)
+        except S3Error as exception:
+            if exception.code in ("NoSuchKey", "NoSuchObject"):
+                return None
+            raise
+        return ObjectStat(stat.size, stat.etag, stat.last_modified)
+
+    def get_object(self, oss_token: str, offset: int = 0, length: int = 0):
+        try:
+            response = self.client.get_object(self.bucket_name, oss_token, offset=offset, length=length)
+        except S3Error as exception:
+            if exception.code == "InvalidRange":
+                raise InvalidRangeException() from exception
+            raise
+        headers = {header: response.headers.get(header)
+                   for header in ("Content-Length", "ETag", "Last-Modified", "Content-Range")
+                   if response.headers.get(header) is not None}
+        return self._stream(response), headers
+
+    @staticmethod
+    def _stream(response):
+        try:
+            yield from response.stream(STORAGE_CHUNK_SIZE)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def put_object(self, oss_token: str, data, size: int, content_type: str = "application/octet-stream") -> None:
+        self.client.put_object(self.bucket_name, oss_token, data, size, content_type=content_type)
+
+    def remove_object(self, oss_token: str) -> None:
+        self.client.remove_object(self.bucket_name, oss_token)
+
+    def remove_objects(self, oss_tokens: list[str]) -> list[str]:
+        # 批量删除接口每次请求最多删除 1000 个对象，返回的是删除失败的对象
+        errors = self.client.remove_objects(self.bucket_name, [DeleteObject(oss_token) for oss_token in oss_tokens])
+        return [error.name for error in errors]
+
+    def download_url(self, oss_token: str, expires: timedelta, request_date: datetime = None) -> str:
+        return self.client.presigned_get_object(self.bucket_name, oss_token, expires=expires,
+                                                request_date=request_date)
+
+    def upload_url(self, oss_token: str, expires: timedelta) -> str:
+        return self.client.presigned_put_object(self.bucket_name, oss_token, expires=expires)
+
+    # minio 没有提供分片上传的公开接口，put_object(length=-1) 只能从流中读取，且流出错时不会结束它的上传线程，
+    # 所以直接调用 Minio 的内部方法，参数与 minio==7.0.4 一致，升级 minio 时需要同步检查这四个方法
+    # pylint: disable=protected-access
+    def supports_multipart(self) -> bool:
+        return minio_version == MINIO_MULTIPART_VERSION
+
+    def create_multipart_upload(self, oss_token: str) -> str:
+        return self.client._create_multipart_upload(self.bucket_name, oss_token,
+                                                    {"Content-Type": "application/octet-stream"})
+
+    def upload_part(self, oss_token: str, upload_id: str, part_number: int, data: bytes) -> str:
+        return self.client._upload_part(self.bucket_name, oss_token, data, None, upload_id, part_number)
+
+    def complete_multipart_upload(self, oss_token: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+        self.client._complete_multipart_upload(self.bucket_name, oss_token, upload_id,
+                                               [Part(part_number, etag) for part_number, etag in parts])
+
+    def abort_multipart_upload(self, oss_token: str, upload_id: str) -> None:
+        self.client._abort_multipart_upload(self.bucket_name, oss_token, upload_id)
+    # pylint: enable=protected-access
+
+
+class LocalStorage(Storage):
+    """
+    objects are stored as files under a local directory, objects are read by mmap and urls are signed with
+    SECRET_KEY and served by /api/file/local, for development and load testing without object storage
+    """
+
+    def __init__(self, directory: str, url_prefix: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = os.path.realpath(directory)
+        self.url_prefix = url_prefix
+        self._multipart_directory = os.path.join(self.directory, ".multipart")
+
+    def _path(self, oss_token: str) -> str:
+        path = os.path.realpath(os.path.join(self.directory, oss_token))
+        if not path.startswith(self.directory + os.sep) or path.startswith(self._multipart_directory + os.sep):
+            raise ValueError("非法的文件路径")
+        return path
+
+    @staticmethod
+    def _stat(stat: os.stat_result) -> ObjectStat:
+        return ObjectStat(stat.st_size, "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size),
+                          datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+    def stat(self, oss_token: str):
+        try:
+            return self._stat(os.stat(self._path(oss_token)))
+        except FileNotFoundError:
+            return None
+
+    def get_object(self, oss_token: str, offset: int = 0, length: int = 0):
+        # 文件由返回的迭代器关闭
+        file = open(self._path(oss_token), "rb")  # pylint:disable=R1732
+        stat = self._stat(os.fstat(file.fileno()))
+        if offset > 0 and offset >= stat.size:
+            file.close()
+            raise InvalidRangeException()
+        length = stat.size - offset if length == 0 else min(length, stat.size - offset)
+        headers = {"Content-Length": str(length), "ETag": '"{}"'.format(stat.etag),
+                   "Last-Modified": http_date(stat.last_modified.timestamp())}
+        if offset > 0 or length < stat.size:
+            headers["Content-Range"] = "bytes {}-{}/{}".format(offset, offset + length - 1, stat.size)
+        return self._stream(file, offset, length), headers
+
+    @staticmethod
+    def _stream(file, offset: int, length: int):
+        try:
+            if length == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(offset, offset + length, STORAGE_CHUNK_SIZE):
+                    yield mapped[start:min(start + STORAGE_CHUNK_SIZE, offset + length)]
+        finally:
+            file.close()
+
+    def _write(self, path: str, data) -> None:
+        # 先写临时文件再替换，读者不会读到写了一半的文件
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            with open(temp_path, "wb") as file:
+                shutil.copyfileobj(data, file, STORAGE_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def put_object(self, oss_token: str, data, size: int, content_type: str = "application/octet-stream") -> None:
+        self._write(self._path(oss_token), data)
+
+    def remove_object(self, oss_token: str) -> None:
+        try:
+            os.remove(self._path(oss_token))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _signature(method: str, oss_token: str, expires: int) -> str:
+        return salted_hmac("trade.storage.LocalStorage", "{}\n{}\n{}".format(method, oss_token, expires),
+                           algorithm="sha256").hexdigest()
+
+    def _signed_url(self, method: str, oss_token: str, expires: int) -> str:
+        return "{}{}?expires={}&signature={}".format(self.url_prefix, quote(oss_token), expires,
+                                                     self._signature(method, oss_token, expires))
+
+    def verify(self, method: str, oss_token: str, expires: str, signature: str) -> bool:
+        """
+        check signature of url generated by download_url or upload_url
+        """
+        if expires is None or signature is None or not expires.isdigit() or int(expires) < time.time():
+            return False
+        return constant_time_compare(self._signature(method, oss_token, int(expires)), signature)
+
+    def download_url(self, oss_token: str, expires: timedelta, request_date: datetime = None) -> str:
+        request_time = time.time() if request_date is None else request_date.replace(tzinfo=timezone.utc).timestamp()
+        return self._signed_url("GET", oss_token, int(request_time + expires.total_seconds()))
+
+    def upload_url(self, oss_token: str, expires: timedelta) -> str:
+        return self._signed_url("PUT", oss_token, int(time.time() + expires.total_seconds()))
+
+    def create_multipart_upload(self, oss_token: str) -> str:
+        self._path(oss_token)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self._multipart_directory, upload_id))
+        return upload_id
+
+    def upload_part(self, oss_token: str, upload_id: str, part_number: int, data: bytes) -> str:
+        with open(os.path.join(self._multipart_directory, upload_id, str(part_number)), "wb") as file:
+            file.write(data)
+        return str(part_number)
+
+    def complete_multipart_upload(self, oss_token: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+        directory = os.path.join(self._multipart_directory, upload_id)
+        path = self._path(oss_token)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, upload_id)
+        try:
+            with open(temp_path, "wb") as file:
+                for part_number, _ in sorted(parts):
+                    with open(os.path.join(directory, str(part_number)), "rb") as part:
+                        shutil.copyfileobj(part, file, STORAGE_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def abort_multipart_upload(self, oss_token: str, upload_id: str) -> None:
+        shutil.rmtree(os.path.join(self._multipart_directory, upload_id), ignore_errors=True)
+
+
+@functools.cache
+def get_storage() -> Storage:
+    """
+    storage backend selected by StorageBackend in config.yaml, created on first use
+    """
+    if STORAGE_BACKEND == "minio":
+        return MinioStorage(S3_ADDRESS, S3_SECRET_ID, S3_SECRET_KEY, S3_SSL, S3_BUCKET_NAME,
+                            create_storage_pool(S3_POOL_SIZE, S3_POOL_TIMEOUT, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT,
+                                                S3_RETRIES, S3_RETRY_BACKOFF))
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(LOCAL_STORAGE_DIR, LOCAL_STORAGE_URL)
+    raise ValueError("不支持的存储后端: {}".format(STORAGE_BACKEND))
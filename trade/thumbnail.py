@@ -0,0 +1,69 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.db import close_old_connections, transaction
+
+from DBProject.settings import THUMBNAIL_WORKERS, THUMBNAIL_SIZE, THUMBNAIL_MAX_SIZE
+from trade.file_util import s3_get_bytes, s3_put_bytes, s3_stat, get_thumbnail_token
+from trade.models.File import File
+
+THUMBNAIL_QUALITY = 80
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+
+
+def make_thumbnail(data: bytes, size: int) -> bytes:
+    """
+    shrink image to fit in size x size and encode it as webp, the aspect ratio is kept
+    :param data: content of original image
+    :param size: max width and height
+    :return: content of thumbnail
+    """
+    with Image.open(BytesIO(data)) as image:
+        # jpeg 可以在解码时直接缩小，避免解码整张大图
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        buffer = BytesIO()
+        image.save(buffer, "WEBP", quality=THUMBNAIL_QUALITY)
+        return buffer.getvalue()
+
+
+def _generate_thumbnail(oss_token: str) -> None:
+    try:
+        stat = s3_stat(oss_token)
+        if stat is None or stat.size > THUMBNAIL_MAX_SIZE:
+            # 过大的图片不读入内存，列表页继续使用原图
+            return
+        data = s3_get_bytes(oss_token)
+        try:
+            thumbnail = make_thumbnail(data, THUMBNAIL_SIZE)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+            # 不是合法图片时不生成缩略图，列表页继续使用原图
+            return
+        s3_put_bytes(get_thumbnail_token(oss_token), thumbnail, "image/webp")
+        # 共享同一对象的记录共享缩略图
+        File.all_objects.filter(oss_token=oss_token).update(has_thumbnail=True)
+    except Exception:
+        # 对象存储或数据库错误不影响上传，记录后列表页继续使用原图
+        logger.exception("生成缩略图失败: %s", oss_token)
+    finally:
+        close_old_connections()
+
+
+def generate_thumbnail(file: File) -> None:
+    """
+    generate thumbnail of an image file in worker pool after current transaction is committed,
+    files whose leading bytes are not an image or larger than THUMBNAIL_MAX_SIZE are skipped
+    :param file: uploaded file
+    """
+    if file.image_type is None:
+        return
+    oss_token = file.oss_token
+    transaction.on_commit(lambda: _executor.submit(_generate_thumbnail, oss_token))
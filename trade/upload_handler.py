@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.http import HttpRequest
+
+from DBProject.settings import MULTIPART_UPLOAD_THRESHOLD, MULTIPART_PART_SIZE, MULTIPART_UPLOAD_WORKERS
+from trade.file_util import get_oss_token, sniff_image_type, IMAGE_HEAD_SIZE
+from trade.storage import get_storage
+from trade.util import get_user, failed_api_response, ErrorCode
+
+# 每个上传同时在发送的分片数，单个上传占用的内存不超过 (MAX_PARTS_IN_FLIGHT + 1) * MULTIPART_PART_SIZE
+MAX_PARTS_IN_FLIGHT = 3
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=MULTIPART_UPLOAD_WORKERS, thread_name_prefix="multipart_upload")
+
+
+class S3UploadedFile(UploadedFile):
+    """
+    file which has been stored in object storage while the request was parsed, its content is not kept locally
+    """
+
+    def __init__(self, name: str, content_type: str, size: int, charset: str, oss_token: str, content_hash: str,
+                 image_type: str):
+        super().__init__(None, name, content_type, size, charset)
+        self.oss_token = oss_token
+        self.content_hash = content_hash
+        self.image_type = image_type
+
+
+class S3MultipartUploadHandler(FileUploadHandler):
+    """
+    upload handler which streams the "file" field of a big request to object storage by multipart upload,
+    parts are sent concurrently by a shared thread pool, small requests are left to the default handlers,
+    so are all requests if the storage backend does not support multipart upload
+    """
+
+    def __init__(self, request: HttpRequest = None):
+        super().__init__(request)
+        self.activated = False
+        self.oss_token = None
+        self.upload_id = None
+        self._buffer = bytearray()
+        self._sha256 = None
+        self._head = b""
+        self._parts = []
+        self._uploaded = False
+        self._in_flight = threading.BoundedSemaphore(MAX_PARTS_IN_FLIGHT)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.activated = content_length >= MULTIPART_UPLOAD_THRESHOLD and get_storage().supports_multipart()
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if not self.activated or field_name != "file" or self.upload_id is not None:
+            return
+        self.oss_token = get_oss_token(get_user(self.request).id, file_name)
+        self.upload_id = get_storage().create_multipart_upload(self.oss_token)
+        self._sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def _upload_part(self, data: bytes, part_number: int) -> tuple[int, str]:
+        try:
+            return part_number, get_storage().upload_part(self.oss_token, self.upload_id, part_number, data)
+        finally:
+            self._in_flight.release()
+
+    def _send_buffer(self) -> None:
+        # 等待空闲的分片位置，限制单个上传占用的内存，位置在发送线程中释放所以不能使用 with
+        self._in_flight.acquire()  # pylint:disable=R1732
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._parts.append(_executor.submit(self._upload_part, data, len(self._parts) + 1))
+
+    def _abort(self) -> None:
+        for part in self._parts:
+            part.cancel()
+        # 等待正在发送的分片结束，否则中止后发送的分片会留在对象存储中
+        wait(self._parts)
+        get_storage().abort_multipart_upload(self.oss_token, self.upload_id)
+        self.upload_id = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._sha256 is None:
+            return raw_data
+        try:
+            self._sha256.update(raw_data)
+            if len(self._head) < IMAGE_HEAD_SIZE:
+                self._head += raw_data[:IMAGE_HEAD_SIZE - len(self._head)]
+            self._buffer.extend(raw_data)
+            if len(self._buffer) >= MULTIPART_PART_SIZE:
+                self._send_buffer()
+        except Exception:
+            self._abort()
+            raise
+        return None
+
+    def file_complete(self, file_size):
+        if self._sha256 is None:
+            return None
+        try:
+            if len(self._buffer) > 0 or len(self._parts) == 0:
+                self._send_buffer()
+            parts = [part.result() for part in self._parts]
+            get_storage().complete_multipart_upload(self.oss_token, self.upload_id, parts)
+        except Exception:
+            self._abort()
+            raise
+        content_hash = self._sha256.hexdigest()
+        self._sha256 = None
+        self.upload_id = None
+        self._uploaded = True
+        return S3UploadedFile(self.file_name, self.content_type, file_size, self.charset, self.oss_token,
+                              content_hash, sniff_image_type(self._head))
+
+    def upload_complete(self):
+        # 请求体被截断时 file_complete 不会被调用
+        if self.upload_id is not None:
+            self._abort()
+
+    def discard(self) -> None:
+        """
+        abort the unfinished upload or remove the uploaded object when parsing the request failed,
+        in which case upload_complete is not called and the view does not run
+        """
+        try:
+            if self.upload_id is not None:
+                self._abort()
+            elif self._uploaded:
+                get_storage().remove_object(self.oss_token)
+        except Exception:
+            logger.exception("清理分片上传失败: %s", self.oss_token)
+
+
+def multipart_upload(func):
+    """
+    decorator to stream big uploaded file to object storage while the request is parsed,
+    must be applied before request.FILES is accessed, e.g. outside validate_request
+    :param func: an api-function
+    :return: wrapped function
+    """
+
+    def wrapper(request: HttpRequest, *args, **kwargs):
+        handler = S3MultipartUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        try:
+            # 在这里解析请求，对象存储出错时返回 json 错误而不是 500
+            request.FILES  # pylint:disable=W0104
+        except Exception as exception:
+            handler.discard()
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, str(exception))
+        return func(request, *args, **kwargs)
+
+    return wrapper
@@ -5,27 +5,31 @@ from trade.api.article import user_new_article, ARTICLE_DETAIL_API, user_get_art
     user_get_collect_article_list
 from trade.api.auth import login, register, admin_login, update_password, check_user_name_exist, batch_register, \
     reset_password
+from trade.api.batch import batch
 from trade.api.comment import comment_order, get_comment_detail, get_commodity_comment_list, get_commodity_grade, \
     admin_get_comment_list
 from trade.api.commodity import add_commodity, COMMODITY_DETAIL_API, user_get_commodity, user_get_shop_commodity_list, \
-    PARAMETER_API, PARA_SET_API, add_parameter, add_para_set
+    PARAMETER_API, PARA_SET_API, add_parameter, add_para_set, multi_get_commodity
 from trade.api.draw import get_consume_statistic
 from trade.api.file import upload_file, download_file, get_file_url, set_user_image, set_shop_image, \
-    add_comment_image, add_commodity_image, set_commodity_main_image
+    add_comment_image, add_commodity_image, set_commodity_main_image, multi_get_file_url, init_upload_file, \
+    complete_upload_file, local_file, admin_get_storage_metrics, get_public_image
 from trade.api.log import list_log, export_log_list
 from trade.api.order import create_order, admin_get_order_list, get_order_detail, update_order_address, close_order, \
     pay_order, deliver_order, confirm_order, user_get_order_list, shop_admin_get_order_list, export_user_order_list, \
-    export_shop_order_list, export_order_list_admin
+    export_shop_order_list, export_order_list_admin, bulk_deliver_order, bulk_close_order, \
+    checkout_order, user_get_order_summary, shop_admin_get_order_summary
 from trade.api.reply import ARTICLE_REPLY_API, REPLY_DETAIL_API
 from trade.api.shop import SHOP_DETAIL_API, list_shop, register_shop, SHOP_ADMIN_API, list_user_shop
 from trade.api.student_auth import ADMIN_STUDENT_AUTH_REQ_API, get_admin_student_auth_reqs, \
     get_student_auth_req_detail, create_student_auth_req, get_student_auth_reqs, check_student_id_exist
-from trade.api.user import USER_DETAIL_API, list_user, export_user_list
+from trade.api.user import USER_DETAIL_API, list_user, export_user_list, multi_get_user
 from trade.views import test
 
 urlpatterns = [
     # for test
     path("test", test),
+    path("batch", batch),
 
     # auth
     path("auth/login", login),
@@ -37,16 +41,23 @@ urlpatterns = [
 
     # file and image
     path("file/upload", upload_file),
+    path("file/upload/init", init_upload_file),
+    path("file/upload/complete", complete_upload_file),
     path("file/download/<int:query_id>", download_file),
     path("file/url/<int:query_id>", get_file_url),
+    path("file/url/multi", multi_get_file_url),
+    path("file/local/<path:oss_token>", local_file),
     path("image/user/<int:query_id>", set_user_image),
     path("image/shop/<int:query_id>", set_shop_image),
     path("image/comment", add_comment_image),
     path("image/commodity", add_commodity_image),
     path("image/comm_main/<int:query_id>", set_commodity_main_image),
+    path("image/public/<str:content_hash>", get_public_image),
+    path("image/public/<str:content_hash>/thumb", get_public_image, {"thumbnail": True}),
 
     # user
     path("user/<int:query_id>", USER_DETAIL_API),
+    path("user/multi", multi_get_user),
 
     # shop
     path("shop/<int:query_id>", SHOP_DETAIL_API),
@@ -57,6 +68,7 @@ urlpatterns = [
     # commodity
     path("shop/comm/add/<int:query_id>", add_commodity),
     path("comm/<int:query_id>", COMMODITY_DETAIL_API),
+    path("comm/multi", multi_get_commodity),
     path("comm/list", user_get_commodity),
     path("shop/comm/list/<int:query_id>", user_get_shop_commodity_list),
     path("comm/para_set/<int:query_id>", PARA_SET_API),
@@ -66,15 +78,20 @@ urlpatterns = [
 
     # order
     path("order/new/<int:query_id>", create_order),
+    path("order/checkout", checkout_order),
     path("order/<int:query_id>", get_order_detail),
     path("order/address/<int:query_id>", update_order_address),
     path("order/close/<int:query_id>", close_order),
     path("order/pay/<int:query_id>", pay_order),
     path("order/deliver/<int:query_id>", deliver_order),
     path("order/confirm/<int:query_id>", confirm_order),
+    path("order/bulk/deliver", bulk_deliver_order),
+    path("order/bulk/close", bulk_close_order),
     path("order/user/list", user_get_order_list),
+    path("order/user/summary", user_get_order_summary),
     path("order/user/list_csv", export_user_order_list),
     path("order/shop/list/<int:query_id>", shop_admin_get_order_list),
+    path("order/shop/summary/<int:query_id>", shop_admin_get_order_summary),
     path("order/shop/list_csv/<int:query_id>", export_shop_order_list),
 
     # comment
@@ -115,6 +132,7 @@ urlpatterns = [
     path("admin/shop/list", list_shop),
     path("admin/order/list", admin_get_order_list),
     path("admin/order/list_csv", export_order_list_admin),
+    path("admin/storage/metrics", admin_get_storage_metrics),
     path("admin/comment/list", admin_get_comment_list),
     path("admin/article/list", admin_get_article_list),
     path("admin/log/list", list_log),
@@ -1,21 +1,34 @@
 import json
 import random
-from datetime import datetime
+from copy import copy
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from enum import unique, Enum
 
 import jwt
 from django.core.mail import send_mail
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction, IntegrityError
 from django.db.models import QuerySet
 from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.utils import timezone
 from django.utils.encoding import escape_uri_path
 from django.views.decorators.http import require_http_methods
 from pandas import DataFrame
 
 from DBProject import settings
 from DBProject.settings import EMAIL_HOST_USER, PASSWORD_CHAR_SET
+from trade.models.IdempotencyRecord import IdempotencyRecord
 from trade.models.User import ROLE_ADMIN, User
 
+_PARSED_DATA_ATTR = "_parsed_data"
+_JWT_PAYLOAD_ATTR = "_jwt_payload"
+_USER_ATTR = "_jwt_user"
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# 处理中的记录超过该时间仍没有响应，认为处理它的进程已经退出
+IDEMPOTENCY_IN_PROGRESS_TIMEOUT = timedelta(minutes=5)
+
 
 @unique
 class ErrorCode(Enum):
@@ -74,6 +87,44 @@ def failed_api_response(code, error_msg=None) -> dict:
         })
 
 
+class FieldDict(dict):
+    """
+    dict built by a model_to_dict function, a callable value is only computed when the field is returned,
+    so the fields left out by the `fields` query parameter cost no query
+    """
+
+
+def parse_fields(request: HttpRequest):
+    """
+    parse the `fields` query parameter, e.g. ?fields=id,name,price
+    :param request: HttpRequest
+    :return: field name set, None if all fields are required
+    """
+    fields = request.GET.get("fields", None)
+    if fields is None:
+        return None
+    fields = {field.strip() for field in fields.split(",") if len(field.strip()) > 0}
+    return fields if len(fields) > 0 else None
+
+
+def resolve_fields(data, fields=None):
+    """
+    keep the required fields of every FieldDict in data and compute their lazy values,
+    nested FieldDict (e.g. the owner of a shop) are always returned completely
+    :param data: response data
+    :param fields: field name set, None for all fields
+    :return: data can be serialized to json
+    """
+    if isinstance(data, FieldDict):
+        return {key: resolve_fields(value() if callable(value) else value)
+                for key, value in data.items() if fields is None or key in fields}
+    if isinstance(data, dict):
+        return {key: resolve_fields(value, fields) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [resolve_fields(item, fields) for item in data]
+    return data
+
+
 def response_wrapper(func):
     """
     decorate a given api-function, parse its return value from a dict to a HttpResponse
@@ -85,7 +136,10 @@ def response_wrapper(func):
         _response = func(*args, **kwargs)
         if isinstance(_response, dict):
             if _response['success']:
-                _response = JsonResponse(_response['data'])
+                fields = None
+                if len(args) > 0 and isinstance(args[0], HttpRequest):
+                    fields = parse_fields(args[0])
+                _response = JsonResponse(resolve_fields(_response['data'], fields))
             else:
                 status_code = _response.get("data").get("code")
                 _response = JsonResponse(_response['data'])
@@ -106,34 +160,36 @@ def require_jwt(admin=False, need_valid=False):
 
     def decorator(view_func):
         def _wrapped_view(request: HttpRequest, *args, **kwargs):
-            try:
-                auth = request.META.get('HTTP_AUTHORIZATION').split(" ")
-                if len(auth) != 2:
-                    return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "无效的token")
-            except AttributeError:
-                return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "缺少AUTHORIZATION头")
-
-            if auth[0] == "Bearer":
+            dic = getattr(request, _JWT_PAYLOAD_ATTR, None)
+            if dic is None:
+                try:
+                    auth = request.META.get('HTTP_AUTHORIZATION').split(" ")
+                    if len(auth) != 2:
+                        return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "无效的token")
+                except AttributeError:
+                    return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "缺少AUTHORIZATION头")
+                if auth[0] != "Bearer":
+                    return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "错误的AUTHORIZATION头")
                 try:
                     dic = jwt.decode(auth[1], settings.SECRET_KEY, algorithms='HS256')
-                    username = dic.get("username", None)
-                    role = dic.get("role", None)
-                    valid = dic.get("valid", False)
                 except jwt.ExpiredSignatureError:
                     return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "Token过期")
                 except jwt.InvalidTokenError:
                     return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "无效的token")
+                setattr(request, _JWT_PAYLOAD_ATTR, dic)
 
-                if username is None or role is None or valid is None:
-                    return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "无效的token")
+            username = dic.get("username", None)
+            role = dic.get("role", None)
+            valid = dic.get("valid", False)
+            if username is None or role is None or valid is None:
+                return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "无效的token")
 
-                if admin and role != ROLE_ADMIN:
-                    return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "需要管理员权限")
-                if need_valid and not valid:
-                    return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "账号封禁中，无法进行该操作")
+            if admin and role != ROLE_ADMIN:
+                return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "需要管理员权限")
+            if need_valid and not valid:
+                return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "账号封禁中，无法进行该操作")
 
-                return view_func(request, *args, **kwargs)
-            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGUMENT_ERROR, "错误的AUTHORIZATION头")
+            return view_func(request, *args, **kwargs)
 
         return _wrapped_view
 
@@ -180,6 +236,38 @@ def require_item_exist(model: models.Model, field: str, item: str):
     return decorator
 
 
+def require_item_fetch(model: models.Model, field: str, item: str, select_related: tuple = (),
+                       prefetch_related: tuple = ()):
+    """
+    decorator to fetch the query item and pass the instance to the view instead of the id
+    :param model: query model
+    :param field: query model field
+    :param item: request filed (defined in urls.py)
+    :param select_related: related fields fetched with join in the same query
+    :param prefetch_related: related fields fetched with prefetch queries
+    :return: wrapped function
+    """
+
+    def decorator(func):
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            item_id = kwargs.get(item)
+            kwargs.pop(item, None)
+            query_set = model.objects.all()
+            if select_related:
+                query_set = query_set.select_related(*select_related)
+            if prefetch_related:
+                query_set = query_set.prefetch_related(*prefetch_related)
+            try:
+                instance = query_set.get(**{field: item_id})
+            except model.DoesNotExist:
+                return failed_api_response(ErrorCode.ITEM_NOT_FOUND_ERROR, "对象不存在")
+            return func(request, instance, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def require_item_miss(model: models.Model, field: str, item: str):
     """
     decorator to check if the query item not exist
@@ -204,31 +292,78 @@ def require_item_miss(model: models.Model, field: str, item: str):
 
 def parse_data(request: HttpRequest):
     """
-    parse request body and return a dict
+    parse request body and return a dict, the body is decoded only once and cached on the request
     :param request: HttpRequest
     :return: request body dict if success else None
     """
+    if not hasattr(request, _PARSED_DATA_ATTR):
+        try:
+            data = json.loads(request.body.decode())
+        except json.JSONDecodeError:
+            data = None
+        setattr(request, _PARSED_DATA_ATTR, data)
+    data = getattr(request, _PARSED_DATA_ATTR)
+    # views modify the dict they get (filter_data, del ...), so every caller gets its own copy
+    if isinstance(data, dict):
+        return copy(data)
+    return data
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_decimal(value) -> bool:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
     try:
-        return json.loads(request.body.decode())
-    except json.JSONDecodeError:
-        return None
+        return Decimal(str(value)).is_finite()
+    except InvalidOperation:
+        return False
 
 
-def require_keys(key_set: set):
+def _compile_type_check(type_spec):
+    """
+    compile a type spec of require_keys to a check function
+    :param type_spec: None (no check), a type, Decimal, or a list with one spec meaning a list of that spec
+    :return: check function
+    """
+    if type_spec is None:
+        return lambda value: True
+    if isinstance(type_spec, list):
+        item_check = _compile_type_check(type_spec[0])
+        return lambda value: isinstance(value, list) and all(item_check(item) for item in value)
+    if type_spec is int:
+        return _is_int
+    if type_spec is Decimal:
+        return _is_decimal
+    if type_spec is float:
+        return lambda value: _is_int(value) or isinstance(value, float)
+    return lambda value: isinstance(value, type_spec)
+
+
+def require_keys(key_set):
     """
     decorator to check if request body contain keys
-    :param key_set: key set
+    :param key_set: key set, or a dict maps key to its type spec, e.g. {"num": int, "select_paras": [int]}
     :return: wrapped function
     """
+    if isinstance(key_set, dict):
+        checks = {key: _compile_type_check(type_spec) for key, type_spec in key_set.items()}
+    else:
+        checks = {key: _compile_type_check(None) for key in key_set}
 
     def decorator(func):
         def wrapper(request: HttpRequest, *args, **kwargs):
             data = parse_data(request)
-            if data is None:
+            if not isinstance(data, dict):
                 return failed_api_response(ErrorCode.BAD_REQUEST_ERROR)
-            for key in key_set:
-                if data.get(key, None) is None:
+            for key, check in checks.items():
+                value = data.get(key, None)
+                if value is None:
                     return failed_api_response(ErrorCode.BAD_REQUEST_ERROR, "缺少必要字段")
+                if not check(value):
+                    return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "字段{}类型错误".format(key))
             return func(request, *args, **kwargs)
 
         return wrapper
@@ -236,6 +371,72 @@ def require_keys(key_set: set):
     return decorator
 
 
+def idempotent(view_func):
+    """
+    decorator to honor Idempotency-Key header, must be placed after require_jwt.
+    the first response of a key is stored and replayed for the same user and path without running the view again,
+    a duplicate arriving while the first request is still running is refused, unless the first request has run
+    longer than IDEMPOTENCY_IN_PROGRESS_TIMEOUT, which means its process died and the key can be used again
+    :param view_func: view function returning an api response dictionary
+    :return: wrapped function
+    """
+
+    def _wrapped_view(request: HttpRequest, *args, **kwargs):
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY", None)
+        if key is None:
+            return view_func(request, *args, **kwargs)
+        if len(key) == 0 or len(key) > 64:
+            return failed_api_response(ErrorCode.INVALID_REQUEST_ARGS, "Idempotency-Key长度应为1~64")
+        user = get_user(request)
+        record = None
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    record = IdempotencyRecord.objects.create(user=user, key=key, endpoint=request.path)
+                break
+            except IntegrityError:
+                existing = IdempotencyRecord.objects.filter(user=user, key=key, endpoint=request.path).first()
+                if existing is None:
+                    continue
+                now = timezone.now()
+                if existing.create_time < now - IDEMPOTENCY_KEY_TTL or \
+                        (existing.response is None and existing.create_time < now - IDEMPOTENCY_IN_PROGRESS_TIMEOUT):
+                    # 过期的记录和处理进程已退出的记录直接替换
+                    IdempotencyRecord.objects.filter(id=existing.id).delete()
+                    continue
+                if existing.response is None:
+                    return failed_api_response(ErrorCode.DUPLICATED_ERROR, "请求正在处理中，请勿重复提交")
+                return json.loads(existing.response)
+        if record is None:
+            return failed_api_response(ErrorCode.DUPLICATED_ERROR, "请求正在处理中，请勿重复提交")
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if isinstance(response, dict):
+            IdempotencyRecord.objects.filter(id=record.id) \
+                .update(response=json.dumps(resolve_fields(response), cls=DjangoJSONEncoder))
+        else:
+            record.delete()
+        return response
+
+    return _wrapped_view
+
+
+def purge_idempotency_records(batch_size: int = 1000) -> int:
+    """
+    delete at most batch_size idempotency records older than IDEMPOTENCY_KEY_TTL
+    :param batch_size: max number of records to delete
+    :return: number of deleted records
+    """
+    ids = list(IdempotencyRecord.objects.filter(create_time__lt=timezone.now() - IDEMPOTENCY_KEY_TTL)
+               .values_list("id", flat=True)[:batch_size])
+    if len(ids) == 0:
+        return 0
+    return IdempotencyRecord.objects.filter(id__in=ids).delete()[0]
+
+
 def filter_data(data: dict, key_set: set) -> None:
     """
     pop key-value from the data whose key not in key_set
@@ -270,17 +471,46 @@ def wrapped_api(api_dict: dict):
 
 def get_user(request: HttpRequest) -> User:
     """
-    parse request token and return user
+    parse request token and return user, the token is decoded and the user is queried only once per request
     :param request: HttpRequest
     :return: user
     """
-    auth = request.META.get('HTTP_AUTHORIZATION').split(" ")
-    dic = jwt.decode(auth[1], settings.SECRET_KEY, algorithms='HS256')
+    user = getattr(request, _USER_ATTR, None)
+    if user is not None:
+        return user
+    dic = getattr(request, _JWT_PAYLOAD_ATTR, None)
+    if dic is None:
+        auth = request.META.get('HTTP_AUTHORIZATION').split(" ")
+        dic = jwt.decode(auth[1], settings.SECRET_KEY, algorithms='HS256')
+        setattr(request, _JWT_PAYLOAD_ATTR, dic)
     username = dic.get("username", None)
     user = User.objects.get(username=username)
+    setattr(request, _USER_ATTR, user)
     return user
 
 
+def share_auth(source: HttpRequest, target: HttpRequest) -> None:
+    """
+    let target request reuse the verified token and the user of source request
+    :param source: request that has passed require_jwt
+    :param target: request built from source, e.g. a sub-request of a batch request
+    :return: None
+    """
+    for attr in (_JWT_PAYLOAD_ATTR, _USER_ATTR):
+        if hasattr(source, attr):
+            setattr(target, attr, getattr(source, attr))
+
+
+def forget_user(request: HttpRequest) -> None:
+    """
+    drop the user cached by get_user, so it is queried again next time, e.g. after a sub-request modified it
+    :param request: HttpRequest
+    :return: None
+    """
+    if hasattr(request, _USER_ATTR):
+        delattr(request, _USER_ATTR)
+
+
 def data_export(query_set: QuerySet, columns: list[str], model_to_dict, bom: bool, filename: str) -> HttpResponse:
     """
     export data to csv and return response